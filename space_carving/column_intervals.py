@@ -0,0 +1,219 @@
+import numpy as np
+
+from typing import Tuple
+
+from utils import project_camera_points, subtract_intervals
+
+
+# ColumnIntervals class that store the foreground voxels as z intervals of each (x, y) column of the grid, and carve them by sampling the projection
+# of each column segment at about one pixel steps instead of projecting every voxel
+
+class ColumnIntervals:
+
+	def __init__(self, shape: Tuple[int, int, int]) -> None:
+		self.__shape = shape
+		self.__columns = shape[1] * shape[2]
+		# Each column owns a range of positions one longer than its voxels, so that the intervals of consecutive columns never touch
+		self.__stride = shape[0] + 1
+		self.__starts = np.arange(self.__columns, dtype=np.int64) * self.__stride
+		self.__ends = self.__starts + shape[0]
+
+
+
+
+	def get_shape(self) -> Tuple[int, int, int]:
+		'''
+		PURPOSE: get the grid shape
+		ARGUMENTS: None
+		RETURN:
+			- (Tuple[int, int, int]): number of voxels along the z, y and x axes
+		'''
+
+		return self.__shape
+
+
+
+
+	def count(self) -> int:
+		'''
+		PURPOSE: get the number of foreground voxels
+		ARGUMENTS: None
+		RETURN:
+			- (int): number of voxels inside the intervals
+		'''
+
+		return int(np.sum(self.__ends - self.__starts))
+
+
+
+
+	def get_intervals(self) -> Tuple[np.ndarray[int, np.int64], np.ndarray[int, np.int64], np.ndarray[int, np.int64]]:
+		'''
+		PURPOSE: get the foreground intervals
+		ARGUMENTS: None
+		RETURN: Tuple[np.ndarray[int, np.int64], np.ndarray[int, np.int64], np.ndarray[int, np.int64]]
+			- (np.ndarray[int, np.int64]): column of each interval, equal to y * x voxels + x
+			- (np.ndarray[int, np.int64]): first z index of each interval
+			- (np.ndarray[int, np.int64]): z index after the end of each interval
+		'''
+
+		columns = self.__starts // self.__stride
+
+		return columns, self.__starts - columns * self.__stride, self.__ends - columns * self.__stride
+
+
+
+
+	def subtract(self,columns: np.ndarray[int, np.int64], z_starts: np.ndarray[int, np.int64], z_ends: np.ndarray[int, np.int64]) -> int:
+		'''
+		PURPOSE: set as background the voxels of a set of z intervals, that may overlap
+		ARGUMENTS:
+			- columns (np.ndarray[int, np.int64]): column of each interval
+			- z_starts (np.ndarray[int, np.int64]): first z index of each interval
+			- z_ends (np.ndarray[int, np.int64]): z index after the end of each interval
+		RETURN:
+			- changed (int): number of voxels that were foreground before
+		'''
+
+		foreground_voxels = self.count()
+		self.__starts, self.__ends = subtract_intervals(self.__starts, self.__ends, columns * self.__stride + z_starts, columns * self.__stride + z_ends)
+
+		return foreground_voxels - self.count()
+
+
+
+
+	def carve_silhouette(self, grid_base: np.ndarray[int, np.float64], grid_axes: np.ndarray[int, np.float64], camera_matrix: np.ndarray[int, np.float64],
+						 dist: np.ndarray[int, np.float64], undist_b_f_image: np.ndarray[int, np.uint8], carved_pixels: np.ndarray[int, np.bool_]) -> int:
+		'''
+		PURPOSE: carve the voxels whose centroid falls on the background, sampling the projected segment of each column between its first and last
+			foreground voxel at about one pixel steps, and assigning each voxel to its closest sample
+		ARGUMENTS:
+			- grid_base (np.ndarray[int, np.float64]): first voxel centroid in the camera reference frame
+			- grid_axes (np.ndarray[int, np.float64]): camera reference frame step along the x, y and z grid axes
+			- camera_matrix (np.ndarray[int, np.float64]): camera intrinsic matrix
+			- dist (np.ndarray[int, np.float64]): distortion coefficients
+			- undist_b_f_image (np.ndarray[int, np.uint8]): undistorted segmented frame
+			- carved_pixels (np.ndarray[int, np.bool_]): pixels of the background samples, updated in place
+		RETURN:
+			- (int): number of voxels carved
+		'''
+
+		if self.__starts.shape[0] == 0: return 0
+
+		height, width = undist_b_f_image.shape[:2]
+		columns_per_row = self.__shape[2]
+
+		# Extent between the first and the last foreground voxel of each column
+		columns, z_starts, z_ends = self.get_intervals()
+		first_interval = np.concatenate(([True], columns[1:] != columns[:-1]))
+		active_columns = columns[first_interval]
+		z_lows = z_starts[first_interval]
+		z_highs = np.maximum.reduceat(z_ends, np.flatnonzero(first_interval))
+		extent = z_highs - z_lows
+
+		# Projected length of each extent, that gives the number of samples, never more than its voxels
+		columns_base = grid_base + np.outer(active_columns % columns_per_row, grid_axes[0]) + np.outer(active_columns // columns_per_row, grid_axes[1])
+		ends_imgpts = project_camera_points(columns_base[:, np.newaxis, :] + np.stack((z_lows, z_highs - 1), axis=1)[:, :, np.newaxis] * grid_axes[2],
+											camera_matrix, dist)
+		length = np.linalg.norm(ends_imgpts[:, 1] - ends_imgpts[:, 0], axis=1)
+		samples = np.minimum(extent, np.ceil(length).astype(np.int64) + 1)
+
+		# Flatten the samples of all the columns and place them along each extent
+		sample_column = np.repeat(np.arange(active_columns.shape[0]), samples)
+		sample_idx = np.arange(sample_column.shape[0]) - np.repeat(np.cumsum(samples) - samples, samples)
+		voxels_per_step = np.where(samples > 1, (extent - 1) / np.maximum(samples - 1, 1), 0.0)[sample_column]
+		sample_z = z_lows[sample_column] + sample_idx * voxels_per_step
+
+		imgpts = project_camera_points(columns_base[sample_column] + sample_z[:, np.newaxis] * grid_axes[2], camera_matrix, dist)
+		inside = (imgpts[:, 0] >= 0) & (imgpts[:, 1] >= 0) & (imgpts[:, 0] < width) & (imgpts[:, 1] < height)
+		pixels = imgpts[inside].astype(np.int32)
+		on_background = undist_b_f_image[pixels[:, 1], pixels[:, 0]] == 0
+		background = np.flatnonzero(inside)[on_background]
+		carved_pixels[pixels[on_background, 1], pixels[on_background, 0]] = True
+
+		# Voxels closest to each background sample, the whole extent if it is sampled only once
+		background_column = sample_column[background]
+		single = samples[background_column] == 1
+		first_voxel = np.where(single, 0, np.ceil((sample_idx[background] - 0.5) * voxels_per_step[background]).astype(np.int64))
+		last_voxel = np.where(single, extent[background_column], np.ceil((sample_idx[background] + 0.5) * voxels_per_step[background]).astype(np.int64))
+		first_voxel, last_voxel = np.maximum(first_voxel, 0), np.minimum(last_voxel, extent[background_column])
+
+		return self.subtract(active_columns[background_column], z_lows[background_column] + first_voxel, z_lows[background_column] + last_voxel)
+
+
+
+
+	def to_dense(self) -> np.ndarray[int, np.bool_]:
+		'''
+		PURPOSE: expand the intervals into a 3D boolean array
+		ARGUMENTS: None
+		RETURN:
+			- (np.ndarray[int, np.bool_]): boolean array indexed as [z, y, x]
+		'''
+
+		# Mark the boundaries of each interval and fill them with a cumulative sum
+		boundaries = np.zeros(self.__columns * self.__stride + 1, dtype=np.int32)
+		np.add.at(boundaries, self.__starts, 1)
+		np.add.at(boundaries, self.__ends, -1)
+		filled = np.reshape(np.cumsum(boundaries)[:-1] > 0, (self.__shape[1], self.__shape[2], self.__stride))[:, :, :self.__shape[0]]
+
+		return np.ascontiguousarray(np.transpose(filled, (2, 0, 1)))
+
+
+
+
+	def set_dense(self, dense: np.ndarray[int, np.bool_]) -> None:
+		'''
+		PURPOSE: replace the intervals with the runs of foreground voxels of a 3D boolean array
+		ARGUMENTS:
+			- dense (np.ndarray[int, np.bool_]): boolean array indexed as [z, y, x]
+		RETURN: None
+		'''
+
+		# Columns laid out one after the other, separated by a background voxel
+		padded = np.zeros((self.__shape[1], self.__shape[2], self.__stride + 1), dtype=np.int8)
+		padded[:, :, 1:-1] = np.transpose(dense, (1, 2, 0))
+		changes = np.diff(np.reshape(padded, (self.__columns, -1)), axis=1)
+		rows, starts = np.nonzero(changes == 1)
+		_, ends = np.nonzero(changes == -1)
+		self.__starts, self.__ends = rows * self.__stride + starts, rows * self.__stride + ends
+
+
+
+
+	def get_packed_bits(self) -> np.ndarray[int, np.uint8]:
+		'''
+		PURPOSE: get the packed bits of the whole grid, with the same layout of the OccupancyGrid, used to save it
+		ARGUMENTS: None
+		RETURN:
+			- (np.ndarray[int, np.uint8]): packed bits, the voxel with flat index idx is the bit idx & 7 of the byte idx >> 3
+		'''
+
+		return np.packbits(self.to_dense(), bitorder='little')
+
+
+
+
+	def set_packed_bits(self, packed_bits: np.ndarray[int, np.uint8]) -> None:
+		'''
+		PURPOSE: replace the intervals with the packed bits returned by get_packed_bits
+		ARGUMENTS:
+			- packed_bits (np.ndarray[int, np.uint8]): packed bits of a grid with the same shape
+		RETURN: None
+		'''
+
+		self.set_dense(np.reshape(np.unpackbits(packed_bits, count=int(np.prod(self.__shape)), bitorder='little').astype(bool), self.__shape))
+
+
+
+
+	def intersect(self, other: 'ColumnIntervals') -> None:
+		'''
+		PURPOSE: keep as foreground only the voxels that are foreground in both grids
+		ARGUMENTS:
+			- other (ColumnIntervals | OccupancyGrid): grid with the same shape
+		RETURN: None
+		'''
+
+		self.set_dense(self.to_dense() & other.to_dense())
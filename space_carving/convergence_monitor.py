@@ -0,0 +1,71 @@
+import numpy as np
+import cv2 as cv
+
+from utils import get_turntable_angle
+
+
+# ConvergenceMonitor class that detects when the hull stops changing, after the whole turntable rotation has been seen
+
+class ConvergenceMonitor:
+
+	def __init__(self, patience: int, min_carved_voxels: int, coverage_bins = 36) -> None:
+		self.__patience = patience
+		self.__min_carved_voxels = min_carved_voxels
+		self.__first_rotation = None
+		self.__seen_bins = np.zeros(coverage_bins, dtype=bool)
+		self.__quiet_carvings = 0
+
+
+
+
+	def update_coverage(self, rvecs: np.ndarray[int, np.float64]) -> None:
+		'''
+		PURPOSE: mark as seen the angular bin of the turntable rotation of the actual frame
+		ARGUMENTS:
+			- rvecs (np.ndarray[int, np.float64]): rotation vector of the board in the actual frame
+		RETURN: None
+		'''
+
+		if self.__first_rotation is None: self.__first_rotation = cv.Rodrigues(rvecs)[0]
+
+		angle = get_turntable_angle(self.__first_rotation, rvecs)
+		self.__seen_bins[int(angle * self.__seen_bins.shape[0] / 360) % self.__seen_bins.shape[0]] = True
+
+
+
+
+	def update_carved(self, carved_voxels: int) -> None:
+		'''
+		PURPOSE: record the number of voxels carved by a frame, or by a batch of frames
+		ARGUMENTS:
+			- carved_voxels (int): number of voxels carved
+		RETURN: None
+		'''
+
+		self.__quiet_carvings = self.__quiet_carvings + 1 if carved_voxels < self.__min_carved_voxels else 0
+
+
+
+
+	def get_coverage(self) -> float:
+		'''
+		PURPOSE: get the fraction of the turntable rotation seen so far
+		ARGUMENTS: None
+		RETURN:
+			- (float): fraction of the angular bins seen
+		'''
+
+		return float(np.mean(self.__seen_bins))
+
+
+
+
+	def has_converged(self) -> bool:
+		'''
+		PURPOSE: check if the whole rotation has been seen and the last carvings removed fewer voxels than the threshold
+		ARGUMENTS: None
+		RETURN:
+			- (bool): True if the remaining frames can be skipped
+		'''
+
+		return bool(np.all(self.__seen_bins)) and self.__quiet_carvings >= self.__patience
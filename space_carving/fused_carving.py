@@ -0,0 +1,69 @@
+import numpy as np
+
+# Numba is an optional dependency, without it the carving falls back to the NumPy implementation
+try:
+	from numba import njit
+except ImportError:
+	njit = None
+
+
+
+def fused_carve_voxels(active_voxels: np.ndarray[int, np.int64], x_voxels: int, y_voxels: int, grid_base: np.ndarray[int, np.float64],
+					   grid_axes: np.ndarray[int, np.float64], camera_matrix: np.ndarray[int, np.float64], dist: np.ndarray[int, np.float64],
+					   undist_b_f_image: np.ndarray[int, np.uint8], occupancy_bits: np.ndarray[int, np.uint8], carved_pixels: np.ndarray[int, np.uint8]) -> int:
+	'''
+	PURPOSE: project, check and carve each active voxel in a single pass, without building any intermediate array
+	ARGUMENTS:
+		- active_voxels (np.ndarray[int, np.int64]): flat index of the voxels to check
+		- x_voxels (int): number of voxels along the x axis
+		- y_voxels (int): number of voxels along the y axis
+		- grid_base (np.ndarray[int, np.float64]): first voxel centroid in the camera reference frame
+		- grid_axes (np.ndarray[int, np.float64]): camera reference frame step along the x, y and z grid axes
+		- camera_matrix (np.ndarray[int, np.float64]): camera intrinsic matrix
+		- dist (np.ndarray[int, np.float64]): 12 distortion coefficients (k1, k2, p1, p2, k3, k4, k5, k6, s1, s2, s3, s4)
+		- undist_b_f_image (np.ndarray[int, np.uint8]): undistorted segmented frame
+		- occupancy_bits (np.ndarray[int, np.uint8]): packed occupancy bits, updated in place
+		- carved_pixels (np.ndarray[int, np.uint8]): pixels of the carved voxels, updated in place
+	RETURN:
+		- carved (int): number of voxels carved
+	'''
+
+	k1, k2, p1, p2, k3, k4, k5, k6, s1, s2, s3, s4 = dist
+	height, width = undist_b_f_image.shape
+	carved = 0
+
+	for voxel_idx in active_voxels:
+
+		# Voxel centroid in the camera reference frame from its grid index
+		i = voxel_idx % x_voxels
+		j = (voxel_idx // x_voxels) % y_voxels
+		k = voxel_idx // (x_voxels * y_voxels)
+		camera_x = grid_base[0] + i * grid_axes[0, 0] + j * grid_axes[1, 0] + k * grid_axes[2, 0]
+		camera_y = grid_base[1] + i * grid_axes[0, 1] + j * grid_axes[1, 1] + k * grid_axes[2, 1]
+		camera_z = grid_base[2] + i * grid_axes[0, 2] + j * grid_axes[1, 2] + k * grid_axes[2, 2]
+
+		# Same distortion model of cv.projectPoints
+		x = camera_x / camera_z
+		y = camera_y / camera_z
+		r2 = x * x + y * y
+		r4 = r2 * r2
+		radial = (1 + r2 * (k1 + r2 * (k2 + r2 * k3))) / (1 + r2 * (k4 + r2 * (k5 + r2 * k6)))
+		u = camera_matrix[0, 0] * (x * radial + 2 * p1 * x * y + p2 * (r2 + 2 * x * x) + s1 * r2 + s2 * r4) + camera_matrix[0, 2]
+		v = camera_matrix[1, 1] * (y * radial + p1 * (r2 + 2 * y * y) + 2 * p2 * x * y + s3 * r2 + s4 * r4) + camera_matrix[1, 2]
+
+		# Carve the voxel if its centroid falls inside the image on the background
+		if u >= 0 and v >= 0 and u < width and v < height and undist_b_f_image[int(v), int(u)] == 0:
+			bit = np.uint8(1 << (voxel_idx & 7))
+			if occupancy_bits[voxel_idx >> 3] & bit:
+				occupancy_bits[voxel_idx >> 3] &= ~bit
+				carved += 1
+			carved_pixels[int(v), int(u)] = 1
+
+	return carved
+
+
+
+# Compile the kernel only when Numba is available
+fused_kernel_available = njit is not None
+if fused_kernel_available:
+	fused_carve_voxels = njit(cache=True, nogil=True)(fused_carve_voxels)
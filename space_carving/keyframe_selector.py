@@ -0,0 +1,87 @@
+import numpy as np
+import cv2 as cv
+
+from typing import Tuple
+
+from utils import get_turntable_angle
+
+
+# KeyframeSelector class that bins the frames by the turntable rotation angle and selects the one with the lowest reprojection error in each bin
+
+class KeyframeSelector:
+
+	def __init__(self, bucket_degrees: float) -> None:
+		self.__bucket_degrees = bucket_degrees
+		self.__first_rotation = None
+		self.__current_bucket = None
+		self.__best_rmse = np.inf
+		self.__best_view = None
+		self.__carved_buckets = set()
+
+
+
+
+	def get_rotation_angle(self, rvecs: np.ndarray[int, np.float64]) -> float:
+		'''
+		PURPOSE: get the board rotation angle around its normal with respect to the first frame
+		ARGUMENTS:
+			- rvecs (np.ndarray[int, np.float64]): rotation vector of the board in the actual frame
+		RETURN:
+			- (float): rotation angle in degrees in [0, 360)
+		'''
+
+		if self.__first_rotation is None: self.__first_rotation = cv.Rodrigues(rvecs)[0]
+
+		return get_turntable_angle(self.__first_rotation, rvecs)
+
+
+
+
+	def update(self, rvecs: np.ndarray[int, np.float64], tvecs: np.ndarray[int, np.float64], rmse: float, undist_frame: np.ndarray[int, np.uint8],
+			   frame_index: int = 0) -> Tuple[np.ndarray[int, np.float64], np.ndarray[int, np.float64], np.ndarray[int, np.uint8], int] | None:
+		'''
+		PURPOSE: offer a frame as keyframe of its angular bucket, the best frame of a bucket is returned once the board leaves it
+		ARGUMENTS:
+			- rvecs (np.ndarray[int, np.float64]): rotation vector of the board
+			- tvecs (np.ndarray[int, np.float64]): translation vector of the board
+			- rmse (float): reprojection RMS pixel error of the frame
+			- undist_frame (np.ndarray[int, np.uint8]): undistorted frame
+			- frame_index (int): index of the frame in the video
+		RETURN:
+			- (Tuple[np.ndarray[int, np.float64], np.ndarray[int, np.float64], np.ndarray[int, np.uint8], int] | None): rotation vector, translation vector,
+				undistorted frame and frame index of the keyframe of the bucket just left, None if the board is still in the same bucket
+		'''
+
+		bucket = int(self.get_rotation_angle(rvecs) // self.__bucket_degrees)
+		keyframe = None
+
+		if bucket != self.__current_bucket:
+			keyframe = self.flush()
+			self.__current_bucket = bucket
+
+		# The buckets seen again after a whole rotation, or because of the pose noise on a boundary, are already carved
+		if bucket not in self.__carved_buckets and rmse < self.__best_rmse:
+			self.__best_rmse = rmse
+			self.__best_view = (rvecs.copy(), tvecs.copy(), undist_frame.copy(), frame_index)
+
+		return keyframe
+
+
+
+
+	def flush(self) -> Tuple[np.ndarray[int, np.float64], np.ndarray[int, np.float64], np.ndarray[int, np.uint8], int] | None:
+		'''
+		PURPOSE: get the keyframe of the actual bucket, called also at the end of the video
+		ARGUMENTS: None
+		RETURN:
+			- (Tuple[np.ndarray[int, np.float64], np.ndarray[int, np.float64], np.ndarray[int, np.uint8], int] | None): rotation vector, translation vector,
+				undistorted frame and frame index of the keyframe, None if the bucket has no candidate
+		'''
+
+		keyframe = self.__best_view
+		if keyframe is not None: self.__carved_buckets.add(self.__current_bucket)
+
+		self.__best_rmse = np.inf
+		self.__best_view = None
+
+		return keyframe
@@ -0,0 +1,319 @@
+import numpy as np
+
+from typing import Tuple
+
+
+# Number of bits set in each possible byte value
+popcount_table = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
+
+# Fraction of set voxels below which the sorted flat indices take less memory than the packed bits
+sparse_fraction = 1 / 32
+
+
+# OccupancyGrid class that store the foreground / background state of each voxel packed in a single bit,
+# or once few voxels are left as the sorted flat indices of the voxels still set
+
+class OccupancyGrid:
+
+	def __init__(self, shape: Tuple[int, int, int]) -> None:
+		self.__shape = shape
+		self.__size = int(np.prod(shape))
+		self.__bits = np.packbits(np.ones(self.__size, dtype=bool), bitorder='little')
+		self.__indices = None
+		self.__indices_dtype = np.uint32 if self.__size <= 2 ** 32 else np.int64
+		self.__count = self.__size
+
+
+
+
+	def get_shape(self) -> Tuple[int, int, int]:
+		'''
+		PURPOSE: get the grid shape
+		ARGUMENTS: None
+		RETURN:
+			- (Tuple[int, int, int]): number of voxels along the z, y and x axes
+		'''
+
+		return self.__shape
+
+
+
+
+	def count(self) -> int:
+		'''
+		PURPOSE: get the number of foreground voxels
+		ARGUMENTS: None
+		RETURN:
+			- (int): number of voxels still set
+		'''
+
+		return self.__count
+
+
+
+
+	def is_sparse(self) -> bool:
+		'''
+		PURPOSE: check if the grid stores the flat indices of the voxels still set instead of the packed bits
+		ARGUMENTS: None
+		RETURN:
+			- (bool): True if the grid is sparse
+		'''
+
+		return self.__indices is not None
+
+
+
+
+	def update_storage(self) -> None:
+		'''
+		PURPOSE: switch to the sparse storage once the fraction of set voxels falls below the threshold, and back to the packed bits
+			if it grows over twice the threshold, called between updates since the kernels and threads keep a reference to the storage
+		ARGUMENTS: None
+		RETURN: None
+		'''
+
+		if self.__indices is None and self.__count < self.__size * sparse_fraction:
+			self.__indices = self.get_set_in_range(0, self.__size).astype(self.__indices_dtype)
+			self.__bits = None
+
+		elif self.__indices is not None and self.__count > 2 * self.__size * sparse_fraction:
+			self.__bits = np.packbits(self.to_dense(), bitorder='little')
+			self.__indices = None
+
+
+
+
+	def get_bits(self) -> np.ndarray[int, np.uint8]:
+		'''
+		PURPOSE: get the packed bits, used by the kernels that update the grid in place, available only if the grid is not sparse
+		ARGUMENTS: None
+		RETURN:
+			- (np.ndarray[int, np.uint8]): packed bits, the voxel with flat index idx is the bit idx & 7 of the byte idx >> 3
+		'''
+
+		return self.__bits
+
+
+
+
+	def get_packed_bits(self) -> np.ndarray[int, np.uint8]:
+		'''
+		PURPOSE: get the packed bits of the whole grid whatever the storage, used to save it
+		ARGUMENTS: None
+		RETURN:
+			- (np.ndarray[int, np.uint8]): packed bits, the voxel with flat index idx is the bit idx & 7 of the byte idx >> 3
+		'''
+
+		if self.__indices is not None: return np.packbits(self.to_dense(), bitorder='little')
+
+		return self.__bits
+
+
+
+
+	def set_packed_bits(self, packed_bits: np.ndarray[int, np.uint8]) -> None:
+		'''
+		PURPOSE: replace the grid with the packed bits returned by get_packed_bits
+		ARGUMENTS:
+			- packed_bits (np.ndarray[int, np.uint8]): packed bits of a grid with the same shape
+		RETURN: None
+		'''
+
+		self.__bits = np.array(packed_bits, dtype=np.uint8)
+		self.__indices = None
+		self.__count = int(popcount_table[self.__bits].sum())
+
+
+
+
+	def decrease_count(self, changed: int) -> None:
+		'''
+		PURPOSE: update the number of foreground voxels after an in place update of the packed bits
+		ARGUMENTS:
+			- changed (int): number of voxels cleared in place
+		RETURN: None
+		'''
+
+		self.__count -= changed
+
+
+
+
+	def test(self, idx: np.ndarray[int, np.int64]) -> np.ndarray[int, np.bool_]:
+		'''
+		PURPOSE: check which voxels are still set
+		ARGUMENTS:
+			- idx (np.ndarray[int, np.int64]): flat voxels indices
+		RETURN:
+			- (np.ndarray[int, np.bool_]): True for the voxels that are set
+		'''
+
+		# The threads read the sorted indices while the main thread replaces them, so they work on a single reference
+		indices = self.__indices
+		if indices is not None:
+			if indices.shape[0] == 0: return np.zeros(np.shape(idx), dtype=bool)
+			position = np.minimum(np.searchsorted(indices, np.asarray(idx).astype(self.__indices_dtype)), indices.shape[0] - 1)
+			return indices[position] == idx
+
+		return ((self.__bits[idx >> 3] >> (idx & 7).astype(np.uint8)) & 1).astype(bool)
+
+
+
+
+	def get_set_in_range(self, start: int, stop: int) -> np.ndarray[int, np.int64]:
+		'''
+		PURPOSE: get the voxels still set in a range of flat indices, without unpacking the whole grid
+		ARGUMENTS:
+			- start (int): first flat index of the range, multiple of 8
+			- stop (int): flat index after the end of the range
+		RETURN:
+			- (np.ndarray[int, np.int64]): flat indices of the voxels that are set
+		'''
+
+		indices = self.__indices
+		if indices is not None:
+			return indices[np.searchsorted(indices, start):np.searchsorted(indices, stop)].astype(np.int64)
+
+		bits = np.unpackbits(self.__bits[start >> 3:(stop + 7) >> 3], count=stop - start, bitorder='little')
+
+		return start + np.flatnonzero(bits)
+
+
+
+
+	def __get_bytes_masks(self, idx: np.ndarray[int, np.int64]) -> Tuple[np.ndarray[int, np.int64], np.ndarray[int, np.uint8]]:
+		'''
+		PURPOSE: group a set of flat indices by the byte that stores them
+		ARGUMENTS:
+			- idx (np.ndarray[int, np.int64]): flat voxels indices without repetitions
+		RETURN: Tuple[np.ndarray[int, np.int64], np.ndarray[int, np.uint8]]
+			- bytes_idx (np.ndarray[int, np.int64]): index of the touched bytes
+			- bytes_masks (np.ndarray[int, np.uint8]): bits to touch in each byte
+		'''
+
+		bytes_idx, inverse = np.unique(idx >> 3, return_inverse=True)
+		# The indices are distinct so the sum of their bits in a byte is equal to their bitwise or
+		bytes_masks = np.bincount(inverse, weights=np.left_shift(1, idx & 7), minlength=bytes_idx.shape[0]).astype(np.uint8)
+
+		return bytes_idx, bytes_masks
+
+
+
+
+	def set(self, idx: np.ndarray[int, np.int64]) -> int:
+		'''
+		PURPOSE: set a group of voxels as foreground
+		ARGUMENTS:
+			- idx (np.ndarray[int, np.int64]): flat voxels indices without repetitions
+		RETURN:
+			- changed (int): number of voxels that were not set before
+		'''
+
+		if self.__indices is not None:
+			indices = np.union1d(self.__indices, np.asarray(idx).astype(self.__indices_dtype))
+			changed = indices.shape[0] - self.__indices.shape[0]
+			self.__indices = indices
+
+		else:
+			bytes_idx, bytes_masks = self.__get_bytes_masks(idx)
+			changed = int(popcount_table[bytes_masks & ~self.__bits[bytes_idx]].sum())
+			self.__bits[bytes_idx] |= bytes_masks
+
+		self.__count += changed
+
+		return changed
+
+
+
+
+	def clear(self, idx: np.ndarray[int, np.int64]) -> int:
+		'''
+		PURPOSE: set a group of voxels as background
+		ARGUMENTS:
+			- idx (np.ndarray[int, np.int64]): flat voxels indices without repetitions
+		RETURN:
+			- changed (int): number of voxels that were set before
+		'''
+
+		if self.__indices is not None:
+			keep = ~np.isin(self.__indices, idx)
+			changed = keep.shape[0] - int(np.count_nonzero(keep))
+			self.__indices = self.__indices[keep]
+
+		else:
+			bytes_idx, bytes_masks = self.__get_bytes_masks(idx)
+			changed = int(popcount_table[bytes_masks & self.__bits[bytes_idx]].sum())
+			self.__bits[bytes_idx] &= ~bytes_masks
+
+		self.__count -= changed
+
+		return changed
+
+
+
+
+	def clear_where(self, mask: np.ndarray[int, np.bool_]) -> int:
+		'''
+		PURPOSE: set as background all the voxels selected by a dense mask
+		ARGUMENTS:
+			- mask (np.ndarray[int, np.bool_]): boolean array with the grid shape
+		RETURN:
+			- changed (int): number of voxels that were set before
+		'''
+
+		if self.__indices is not None:
+			keep = ~np.ravel(mask)[self.__indices]
+			changed = keep.shape[0] - int(np.count_nonzero(keep))
+			self.__indices = self.__indices[keep]
+
+		else:
+			packed_mask = np.packbits(np.ravel(mask), bitorder='little')
+			changed = int(popcount_table[packed_mask & self.__bits].sum())
+			self.__bits &= ~packed_mask
+
+		self.__count -= changed
+
+		return changed
+
+
+
+
+	def to_dense(self) -> np.ndarray[int, np.bool_]:
+		'''
+		PURPOSE: unpack the grid into a 3D boolean array
+		ARGUMENTS: None
+		RETURN:
+			- (np.ndarray[int, np.bool_]): boolean array indexed as [z, y, x]
+		'''
+
+		if self.__indices is not None:
+			dense = np.zeros(self.__size, dtype=bool)
+			dense[self.__indices] = True
+			return np.reshape(dense, self.__shape)
+
+		return np.reshape(np.unpackbits(self.__bits, count=self.__size, bitorder='little').astype(bool), self.__shape)
+
+
+
+
+	def intersect(self, other: 'OccupancyGrid') -> None:
+		'''
+		PURPOSE: keep as foreground only the voxels that are foreground in both grids
+		ARGUMENTS:
+			- other (OccupancyGrid): grid with the same shape
+		RETURN: None
+		'''
+
+		if self.__indices is None and not other.is_sparse():
+			self.__bits &= other.get_bits()
+			self.__count = int(popcount_table[self.__bits].sum())
+
+		else:
+			# At least one grid is sparse, so only its few voxels are tested in the other one
+			sparse_grid, other_grid = (self, other) if self.__indices is not None else (other, self)
+			indices = sparse_grid.get_set_in_range(0, self.__size)
+			indices = indices[other_grid.test(indices)]
+			self.__bits = None
+			self.__indices = indices.astype(self.__indices_dtype)
+			self.__count = indices.shape[0]
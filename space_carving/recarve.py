@@ -0,0 +1,139 @@
+import numpy as np
+import time
+import argparse
+import os
+
+from typing import List
+
+from utils import write_ply_file, load_cached_views
+from voxels_cube import VoxelsCube
+from space_carving import parameters
+
+
+
+def main(voxel_cube_edge_dims: List[int], hierarchical: bool, footprint: bool, batch_size: int, fused: bool, threads: int, ignore_frames: List[int], ascii_ply: bool) -> None:
+	'''
+	PURPOSE: carve again each object at several resolutions in a single pass over the poses and silhouettes cached by space_carving.py,
+		without decoding, tracking and segmenting the video
+	ARGUMENTS:
+		- voxel_cube_edge_dims (List[int]): dimension of a voxel cube edge of each resolution
+		- hierarchical (bool): boolean variable to indicate the usage of the coarse to fine carving
+		- footprint (bool): boolean variable to indicate the usage of the conservative voxels footprint carving
+		- batch_size (int): number of cached frames carved together in each resolution
+		- fused (bool): boolean variable to indicate the usage of the Numba fused project and carve kernel
+		- threads (int): number of threads that carve a chunk of the voxels of each frame
+		- ignore_frames (List[int]): index of the frames not carved, the grid with the shape and box of the saved carve provenance is rebuilt from it without them
+		- ascii_ply (bool): boolean variable to write the PLY files in ASCII instead of binary
+	RETURN: None
+	'''
+
+	# Check if the user run the camera calibration program before
+	if not os.path.exists('./calibration_info/cameraMatrix.npy') or not os.path.exists('./calibration_info/dist.npy'):
+		print('Please, before running the project, execute the camera calibration program.')
+		return
+
+	# Load the camera matrix and distorsion coefficients
+	camera_matrix = np.load('./calibration_info/cameraMatrix.npy')
+	dist = np.load('./calibration_info/dist.npy')
+
+	ignore_frames = set(ignore_frames)
+
+	# Iterate for each object
+	for obj, hyper_param in parameters.items():
+
+		obj_id = obj.split('.')[0]
+		cache_path = f'../output_project/{obj_id}/{obj_id}_views.pkl'
+		carved_at_path = f'../output_project/{obj_id}/{obj_id}_carved_at.npz'
+
+		if not os.path.exists(cache_path):
+			print(f'No cached views of {obj}, run space_carving.py with the --cache_views option first.\n')
+			continue
+
+		print(f'Carving again {obj} with the voxel cube edges {voxel_cube_edge_dims}...')
+		start = time.time()
+
+		# The carve provenance saved with the --provenance option rebuilds the grid of the same shape and box without the ignored frames
+		provenance = np.load(carved_at_path) if len(ignore_frames) > 0 and os.path.exists(carved_at_path) else None
+
+		# The grids are created once the first silhouette gives the undistorted frame resolution
+		voxels_cubes, rebuilt_cubes, carved_cubes = None, [], []
+		pending_views, pending_frames = [], []
+		n_views = 0
+
+		# Each cached view is read and unpacked once and carved in every grid
+		for frame_index, rvecs, tvecs, undist_mask in load_cached_views(cache_path):
+			if frame_index in ignore_frames: continue
+
+			if voxels_cubes is None:
+				voxels_cubes = [VoxelsCube(hyper_param['cube_half_edge'], voxel_cube_edge_dim, camera_matrix, dist, undist_mask.shape[1], undist_mask.shape[0],
+										   hierarchical=hierarchical, footprint=footprint, fused=fused, threads=threads) for voxel_cube_edge_dim in voxel_cube_edge_dims]
+
+				for idx, voxel_cube_edge_dim in enumerate(voxel_cube_edge_dims):
+					# The provenance indexes the voxels of the grid it was recorded on, so it is restored only if the shape and the box are the same
+					if provenance is not None and tuple(provenance['grid_shape']) == voxels_cubes[idx].get_occupancy().get_shape() and \
+							np.allclose(provenance['grid_bounds'], np.stack(voxels_cubes[idx].get_grid_bounds())):
+						voxels_cubes[idx].close()
+						voxels_cubes[idx] = VoxelsCube(hyper_param['cube_half_edge'], voxel_cube_edge_dim, camera_matrix, dist, undist_mask.shape[1], undist_mask.shape[0],
+													   hierarchical=hierarchical, footprint=footprint, fused=fused, threads=threads, provenance=True)
+						voxels_cubes[idx].set_carved_at(provenance['carved_at'])
+						rebuilt_cubes.append(voxels_cubes[idx])
+					else: carved_cubes.append(voxels_cubes[idx])
+
+				if provenance is not None and len(rebuilt_cubes) == 0: print(' the saved carve provenance was recorded on a different grid, carving from scratch')
+				if len(carved_cubes) == 0: break
+
+			pending_views.append((rvecs, tvecs, undist_mask))
+			pending_frames.append(frame_index)
+			n_views += 1
+
+			if len(pending_views) == batch_size:
+				for voxels_cube in carved_cubes: voxels_cube.carve_views(pending_views, pending_frames)
+				pending_views, pending_frames = [], []
+
+		if voxels_cubes is None:
+			print(' no views to carve\n')
+			continue
+
+		# Carve the last incomplete frames batch
+		if len(pending_views) > 0:
+			for voxels_cube in carved_cubes: voxels_cube.carve_views(pending_views, pending_frames)
+
+		if len(carved_cubes) > 0: print(f' {n_views} views carved from scratch in {time.time() - start:.2f} seconds')
+
+		# Only the voxels carved by the ignored frames are tested again, with the following cached frames
+		for voxels_cube in rebuilt_cubes:
+			start = time.time()
+			restored = voxels_cube.rebuild_occupancy(load_cached_views(cache_path), ignore_frames)
+			print(f' {restored} voxels restored from the saved carve provenance in {time.time() - start:.2f} seconds')
+
+		print(' DONE')
+
+		print('Saving PLY files...')
+
+		# Save a .ply file for each resolution
+		for voxel_cube_edge_dim, voxels_cube in zip(voxel_cube_edge_dims, voxels_cubes):
+			voxels_cube_coords, voxels_cube_faces = voxels_cube.get_cubes_coords_and_faces()
+			write_ply_file(obj_id, voxels_cube_coords, voxels_cube_faces, f'_{voxel_cube_edge_dim}', binary=not ascii_ply)
+			voxels_cube.close()
+		print(' DONE\n')
+
+
+
+if __name__ == "__main__":
+
+	# Get the console arguments
+	parser = argparse.ArgumentParser(prog='Recarve', description='Carve again the cached views of the Space Carving Project at several resolutions')
+	parser.add_argument('--hierarchical', dest='hierarchical', default=False, action='store_true', help='Carve coarse to fine, subdividing only the ambiguous cells of voxels')
+	parser.add_argument('--footprint', dest='footprint', default=False, action='store_true', help='Carve a voxel only when its whole projected footprint is background')
+	parser.add_argument('--batch_size', dest='batch_size', type=int, default=1, help='Number of cached frames carved together in each resolution')
+	parser.add_argument('--fused', dest='fused', default=False, action='store_true', help='Project and carve the voxels with a single Numba compiled kernel, frame by frame')
+	parser.add_argument('--threads', dest='threads', type=int, default=1, help='Number of threads that carve a chunk of the voxels of each frame')
+	parser.add_argument('--ignore_frames', dest='ignore_frames', type=int, nargs='+', default=[], help='Index of the cached frames not carved, rebuilding from the saved carve provenance when available')
+	parser.add_argument('--ascii_ply', dest='ascii_ply', default=False, action='store_true', help='Write the PLY files in ASCII instead of binary')
+	parser.add_argument('voxel_cube_edge_dims', type=int, nargs='+', help='Dimension of a voxel cube edge of each resolution')
+	args = parser.parse_args()
+
+	if any(voxel_cube_edge_dim <= 0 for voxel_cube_edge_dim in args.voxel_cube_edge_dims): raise ValueError('The voxel_cube_edge_dims must be positive integer numbers')
+	if args.batch_size <= 0: raise ValueError('The batch_size must be a positive integer number')
+
+	main(args.voxel_cube_edge_dims, args.hierarchical, args.footprint, args.batch_size, args.fused, args.threads, args.ignore_frames, args.ascii_ply)
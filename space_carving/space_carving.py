@@ -5,10 +5,18 @@ import copy
 import argparse
 import os
 
-from utils import set_marker_reference_coords, resize_for_laptop, write_ply_file
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Tuple
+
+from occupancy_grid import OccupancyGrid
+from utils import set_marker_reference_coords, resize_for_laptop, seek_video_frame, write_ply_file, pack_mask, unpack_mask, save_checkpoint, load_checkpoint, append_cached_view, load_cached_views
 from background_foreground_segmentation import apply_segmentation
 from board import Board
+from keyframe_selector import KeyframeSelector
+from convergence_monitor import ConvergenceMonitor
+from turntable_pose_estimator import TurntablePoseEstimator
 from voxels_cube import VoxelsCube
+from visual_hull import VisualHull
 
 
 # Objects cube_half_edge parameters
@@ -19,14 +27,119 @@ parameters = {
 	'obj04.mp4': {'cube_half_edge': 55},
 }
 
+# Voxel cube edge of the coarse carving that estimates the bounding box of an object
+bounding_box_voxel_edge = 4
+
+
+
+def carve_views_shard(voxels_cube_params: Dict[str, Any], views_shard: List[Tuple[np.ndarray[int, np.float64], np.ndarray[int, np.float64], np.ndarray[int, np.uint8], Tuple[int, int]]],
+					  batch_size: int, frames_shard: List[int]) -> Tuple[OccupancyGrid, np.ndarray[int, np.uint16] | None]:
+	'''
+	PURPOSE: carve a private voxels grid with a shard of the frames, executed by each process of the pool
+	ARGUMENTS:
+		- voxels_cube_params (Dict[str, Any]): arguments of the VoxelsCube object
+		- views_shard (List[Tuple[np.ndarray[int, np.float64], np.ndarray[int, np.float64], np.ndarray[int, np.uint8], Tuple[int, int]]]): rotation vector,
+			translation vector, packed segmented frame and its resolution of each frame of the shard
+		- batch_size (int): number of frames carved together
+		- frames_shard (List[int]): index of each frame of the shard
+	RETURN: Tuple[OccupancyGrid, np.ndarray[int, np.uint16] | None]
+		- (OccupancyGrid): occupancy grid carved by the shard
+		- (np.ndarray[int, np.uint16] | None): carve provenance of the shard, None if it is not recorded
+	'''
+
+	voxels_cube = VoxelsCube(**voxels_cube_params)
+
+	for start in range(0, len(views_shard), batch_size):
+		voxels_cube.carve_views([(rvecs, tvecs, unpack_mask(packed_mask, mask_shape)) for rvecs, tvecs, packed_mask, mask_shape in views_shard[start:start + batch_size]],
+								frames_shard[start:start + batch_size])
+	voxels_cube.close()
+
+	return voxels_cube.get_occupancy(), voxels_cube.get_carved_at()
+
+
+
+def estimate_bounding_box(obj: str, input_video: cv.VideoCapture, camera_matrix: np.ndarray[int, np.float64], dist: np.ndarray[int, np.float64],
+						  cube_half_edge: int, marker_reference: Dict[int, Tuple[int, int, int]], n_frames: int) \
+		-> Tuple[np.ndarray[int, np.float64], np.ndarray[int, np.float64]] | None:
+	'''
+	PURPOSE: estimate a tight bounding box of the object intersecting the silhouette cones of a few widely spaced frames with a coarse conservative carving
+	ARGUMENTS:
+		- obj (str): video file name of the object
+		- input_video (cv.VideoCapture): video of the object, rewinded at the end
+		- camera_matrix (np.ndarray[int, np.float64]): camera intrinsic matrix
+		- dist (np.ndarray[int, np.float64]): distortion coefficients
+		- cube_half_edge (int): half edge of the cube above the board that contains the object
+		- marker_reference (Dict[int, Tuple[int, int, int]]): marker reference coordinates
+		- n_frames (int): number of frames evenly spaced in the video
+	RETURN:
+		- (Tuple[np.ndarray[int, np.float64], np.ndarray[int, np.float64]] | None): lower and upper x, y, z coordinates of the box, None if it cannot be estimated
+	'''
+
+	frame_width, frame_height = int(input_video.get(cv.CAP_PROP_FRAME_WIDTH)), int(input_video.get(cv.CAP_PROP_FRAME_HEIGHT))
+	# The footprint carving removes a voxel only if it is entirely outside a silhouette, so the box never cuts the object
+	voxels_cube = VoxelsCube(cube_half_edge, bounding_box_voxel_edge, camera_matrix, dist, frame_width, frame_height, footprint=True)
+	voxels_cube.get_newCameraMatrix()
+	board = Board(n_polygons=24)
+	views = []
+
+	# Each frame is detected from scratch, without the optical flow tracking of the previous frame
+	for frame_index in np.linspace(0, int(input_video.get(cv.CAP_PROP_FRAME_COUNT)) - 1, n_frames).astype(int):
+		seek_video_frame(input_video, frame_index)
+		ret, frame = input_video.read()
+		if not ret: continue
+
+		undist_frame = voxels_cube.get_undistorted_frame(frame)
+		frameg = cv.cvtColor(undist_frame, cv.COLOR_BGR2GRAY)
+		_, thresh = cv.threshold(frameg, 0, 255, cv.THRESH_BINARY + cv.THRESH_OTSU)
+		board.find_interesting_points(thresh, frameg)
+		markers_info = board.compute_markers(thresh, board.get_clockwise_vertices(), marker_reference)
 
+		if markers_info.shape[0] > 6:
+			voxels_cube.apply_projections(markers_info[:,1:3], markers_info[:,3:6])
+			views.append((*voxels_cube.get_pose(), apply_segmentation(obj, undist_frame)))
 
-def main(using_laptop: bool, voxel_cube_edge_dim: int) -> None:
+	input_video.set(cv.CAP_PROP_POS_FRAMES, 0)
+	if len(views) < 2: return None
+
+	voxels_cube.carve_views(views)
+	bounding_box = voxels_cube.get_foreground_bounding_box()
+	if bounding_box is None: return None
+
+	# Grow the box by a coarse voxel, without leaving the starting cube
+	cube_lower, cube_upper = np.array([-cube_half_edge, -cube_half_edge, 70]), np.array([cube_half_edge, cube_half_edge, 70 + cube_half_edge * 2])
+
+	return np.maximum(bounding_box[0] - bounding_box_voxel_edge, cube_lower), np.minimum(bounding_box[1] + bounding_box_voxel_edge, cube_upper)
+
+
+
+def main(using_laptop: bool, voxel_cube_edge_dim: int, hierarchical: bool, footprint: bool, batch_size: int, fused: bool, processes: int, threads: int, memory_budget_mb: int | None, checkpoint_every: int, resume: bool, keyframe_degrees: float | None,
+		 converge_patience: int | None, converge_min_voxels: int, intervals: bool, z_subdivisions: int,
+		 visual_hull_step: float | None, auto_box_frames: int | None, provenance: bool, cache_views: bool, turntable_frames: int | None, ascii_ply: bool) -> None:
 	'''
 	PURPOSE: function that start the whole computation
 	ARGUMENTS:
 		- using_laptop (bool): boolean variable to indicate the usage of an HD laptop or not
 		- voxel_cube_edge_dim (int): pixel dimension of a voxel cube edge
+		- hierarchical (bool): boolean variable to indicate the usage of the coarse to fine carving
+		- footprint (bool): boolean variable to indicate the usage of the conservative voxels footprint carving
+		- batch_size (int): number of frames carved together, 1 to carve and draw each frame as soon as it is processed
+		- fused (bool): boolean variable to indicate the usage of the Numba fused project and carve kernel
+		- processes (int): number of processes that carve a shard of the frames once the whole video is processed, 1 to carve in the main loop
+		- threads (int): number of threads that carve a chunk of the voxels of each frame
+		- memory_budget_mb (int | None): memory budget of the tiled grid in MB, None to keep the whole grid in memory
+		- checkpoint_every (int): number of frames between two checkpoints of the carving state, 0 to disable them
+		- resume (bool): boolean variable to indicate to continue each object from its last checkpoint
+		- keyframe_degrees (float | None): width in degrees of the turntable angular buckets whose best frame is carved, None to carve every frame
+		- converge_patience (int | None): number of consecutive carvings below converge_min_voxels after which the object is done, None to process the whole video
+		- converge_min_voxels (int): number of carved voxels below which a carving does not change the hull
+		- intervals (bool): boolean variable to indicate the usage of the column intervals carving
+		- z_subdivisions (int): number of slices along z of each voxel of the column intervals carving
+		- visual_hull_step (float | None): spacing of the rays of the visual hull engine, None to carve the voxels
+		- auto_box_frames (int | None): number of frames used to estimate the bounding box of each object, None to carve the whole cube
+		- provenance (bool): boolean variable to indicate to record and save the frame that carved each voxel
+		- cache_views (bool): boolean variable to indicate to save the pose and the silhouette of each segmented frame, to carve it again with recarve.py
+		- turntable_frames (int | None): number of first frames used to estimate the camera to turntable transform, None to solve a full PnP for each frame
+		- ascii_ply (bool): boolean variable to write the PLY file in ASCII instead of binary
 	RETURN: None
 	'''
 	 
@@ -41,6 +154,14 @@ def main(using_laptop: bool, voxel_cube_edge_dim: int) -> None:
 	# Load the camera matrix and distorsion coefficients
 	camera_matrix = np.load('./calibration_info/cameraMatrix.npy')
 	dist = np.load('./calibration_info/dist.npy')
+
+	# The visual hull is carved in the main loop and has no occupancy grid to share or to save
+	if visual_hull_step is not None and (processes > 1 or checkpoint_every > 0 or resume):
+		print('The visual hull engine carves the frames in the main loop without checkpoints, ignoring the processes, checkpoint and resume options.')
+		processes, checkpoint_every, resume = 1, 0, False
+	if visual_hull_step is not None and provenance:
+		print('The visual hull engine carves rays instead of voxels, ignoring the provenance option.')
+		provenance = False
   
   
 	# Iterate for each object
@@ -64,18 +185,97 @@ def main(using_laptop: bool, voxel_cube_edge_dim: int) -> None:
   
 		cube_half_edge = hyper_param['cube_half_edge']
 
+		# Shrink the grid to the box that contains the silhouette cones of a few widely spaced frames
+		bounding_box = None
+		if auto_box_frames is not None:
+			bounding_box = estimate_bounding_box(obj, input_video, camera_matrix, dist, cube_half_edge, marker_reference, auto_box_frames)
+			if bounding_box is not None: print(f' bounding box from {np.round(bounding_box[0], 1)} to {np.round(bounding_box[1], 1)}')
+
 		# Create the Board object
 		board = Board(n_polygons=24)
 
 		# Create the VoxelsCube object
-		voxels_cube = VoxelsCube(cube_half_edge=cube_half_edge, voxel_cube_edge_dim=voxel_cube_edge_dim, camera_matrix=camera_matrix, dist=dist, frame_width=frame_width, frame_height=frame_height)
+		voxels_cube_params = dict(cube_half_edge=cube_half_edge, voxel_cube_edge_dim=voxel_cube_edge_dim, camera_matrix=camera_matrix, dist=dist,
+								  frame_width=frame_width, frame_height=frame_height, hierarchical=hierarchical, footprint=footprint, fused=fused, threads=threads,
+								  memory_budget_mb=memory_budget_mb, intervals=intervals, z_subdivisions=z_subdivisions,
+								  bounding_box=bounding_box, provenance=provenance)
+		# With the visual hull engine the voxels cube only estimates the pose and draws the frame, without a voxels grid, while the rays are carved
+		voxels_cube = VoxelsCube(**voxels_cube_params, pose_only=visual_hull_step is not None)
+		visual_hull = VisualHull(cube_half_edge, visual_hull_step, camera_matrix, dist, bounding_box) if visual_hull_step is not None else None
+		carver = visual_hull if visual_hull is not None else voxels_cube
   
 		# Create output video writer initialized at None since we do not know the undistorted resolution
 		output_video = None
 
+		# Poses and masks of the frames waiting to be carved, with their frame index
+		pending_views, pending_frames = [], []
+
+		# Select the best frame of each angular bucket of the turntable rotation
+		keyframe_selector = KeyframeSelector(keyframe_degrees) if keyframe_degrees is not None else None
+
+		# Estimate the camera to turntable transform once, and then only the rotation angle of each frame
+		pose_estimator = TurntablePoseEstimator(camera_matrix, dist, turntable_frames) if turntable_frames is not None else None
+
+		# Stop the object once the whole rotation is seen and the hull stops changing, not possible if the frames are carved after the video
+		convergence_monitor = ConvergenceMonitor(converge_patience, converge_min_voxels) if converge_patience is not None and processes == 1 else None
+
 		# Get the new camera intrinsic matrix based on the free scaling parameter
 		voxels_cube.get_newCameraMatrix()
 
+		checkpoint_dir = f'../output_project/{obj_id}/checkpoint'
+		start_frame, views_offset, pending_offset, saved_processes = 0, None, 0, processes
+
+		# With several processes the frames are carved after the video, so their views are appended to a file and the checkpoints store only its length
+		views_path = f'../output_project/{obj_id}/{obj_id}_views.pkl' if cache_views else os.path.join(checkpoint_dir, 'pending_views.pkl')
+
+		if resume:
+			packed_bits, carved_at, state = load_checkpoint(checkpoint_dir)
+
+			if state is not None and state['voxel_cube_edge_dim'] == voxel_cube_edge_dim:
+				if state['completed']:
+					print(' already DONE\n')
+					input_video.release()
+					voxels_cube.close()
+					continue
+
+				# Restore the occupancy grid, the tracker state and the statistics, then seek to the first frame not processed
+				occupancy = OccupancyGrid(voxels_cube.get_occupancy().get_shape())
+				occupancy.set_packed_bits(packed_bits)
+				voxels_cube.intersect_occupancy(occupancy, np.asarray(carved_at) if carved_at is not None else None)
+				start_frame, avg_fps, avg_rmse = state['frame_index'], state['avg_fps'], state['avg_rmse']
+				board, prev_frameg, pending_views, pending_frames = state['board'], state['prev_frameg'], state['pending_views'], state['pending_frames']
+				views_offset, pending_offset, saved_processes = state.get('views_offset'), state.get('pending_offset', 0), state.get('processes', 1)
+				keyframe_selector, convergence_monitor = state['keyframe_selector'], state['convergence_monitor']
+				if pose_estimator is not None and state.get('pose_estimator') is not None: pose_estimator = state['pose_estimator']
+				actual_fps = start_frame
+
+				seek_video_frame(input_video, start_frame)
+				print(f' resuming from frame {start_frame}...')
+
+		# A resumed carving drops the views appended after the checkpoint, since their frames are processed again
+		views_cache = None
+		if cache_views or (processes > 1 and (checkpoint_every > 0 or pending_views is None)):
+			os.makedirs(os.path.dirname(views_path), exist_ok=True)
+			views_cache = open(views_path, 'ab' if start_frame > 0 and os.path.exists(views_path) else 'wb')
+			if start_frame > 0 and views_offset is not None: views_cache.truncate(views_offset)
+
+		# The views waiting for the processes are read back from the file, a run with a single process carves them right away one batch at a time
+		if pending_views is None:
+			pending_views, pending_frames = [], []
+			for frame_index, rvecs, tvecs, undist_mask in load_cached_views(views_path, pending_offset):
+				pending_views.append((rvecs, tvecs, *pack_mask(undist_mask)) if processes > 1 else (rvecs, tvecs, undist_mask))
+				pending_frames.append(frame_index)
+				if processes == 1 and len(pending_views) == batch_size:
+					carver.carve_views(pending_views, pending_frames)
+					pending_views, pending_frames = [], []
+
+		# The few views left by a checkpoint with a single process are not in the views file, so a run with several processes carves them
+		# right away and collects its own views from the end of the file
+		elif processes > 1 and saved_processes == 1:
+			if len(pending_views) > 0: carver.carve_views(pending_views, pending_frames)
+			pending_views, pending_frames = [], []
+			pending_offset = views_cache.seek(0, os.SEEK_END) if views_cache is not None else 0
+
 		while True:
       
 			start = time.time()
@@ -91,7 +291,9 @@ def main(using_laptop: bool, voxel_cube_edge_dim: int) -> None:
 			# Update width, height and output_video
 			if output_video is None: 
 				frame_width, frame_height = undist_frame.shape[1], undist_frame.shape[0] 
-				output_video = cv.VideoWriter(f'../output_project/{obj_id}/{obj_id}.mp4', cv.VideoWriter_fourcc(*'mp4v'), input_video.get(cv.CAP_PROP_FPS), (frame_width, frame_height))
+				# A resumed carving writes the remaining frames in a new video, to not overwrite the frames already written
+				video_path = f'../output_project/{obj_id}/{obj_id}.mp4' if start_frame == 0 else f'../output_project/{obj_id}/{obj_id}_from_{start_frame}.mp4'
+				output_video = cv.VideoWriter(video_path, cv.VideoWriter_fourcc(*'mp4v'), input_video.get(cv.CAP_PROP_FPS), (frame_width, frame_height))
 			
 			# Get the gray frame
 			frameg = cv.cvtColor(undist_frame, cv.COLOR_BGR2GRAY)
@@ -129,20 +331,58 @@ def main(using_laptop: bool, voxel_cube_edge_dim: int) -> None:
     
     
 				# Get the projection of the board centroid, of the cube vertices and of the voxels centroids
-				imgpts_centroid, imgpts_cube = voxels_cube.apply_projections(twoD_points, threeD_points)
+				imgpts_centroid, imgpts_cube = voxels_cube.apply_projections(twoD_points, threeD_points, pose_estimator)
 
 				# Get the RMS pixel error of reprojection points for the actual frame
-				avg_rmse += voxels_cube.compute_RMSE(indices_ID, marker_reference, twoD_points)
-    
-				# Apply the segmentation on the undistorted frame
-				undist_mask = apply_segmentation(obj, undist_frame)
+				rmse = voxels_cube.compute_RMSE(indices_ID, marker_reference, twoD_points)
+				avg_rmse += rmse
+
+				# Track how much of the rotation has been seen and how many voxels are carved
+				if convergence_monitor is not None: convergence_monitor.update_coverage(voxels_cube.get_pose()[0])
+				carved_voxels = None
 
 				# Draw the projected cube and centroid axes
 				edited_frame = board.draw_origin(edited_frame, np.int32(imgpts_centroid))
 				edited_frame = voxels_cube.draw_cube(edited_frame, np.int32(imgpts_cube))
-    
-				# Update the binary array of foreground voxels and draw the background
-				edited_frame = voxels_cube.set_background_voxels((frame_width, frame_height), undist_mask, edited_frame)
+
+				# With the keyframe selection a frame is segmented and carved only if it is the best of its angular bucket, once the board leaves it
+				keyframe = keyframe_selector.update(*voxels_cube.get_pose(), rmse, undist_frame, actual_fps) if keyframe_selector is not None else None
+
+				if keyframe is not None:
+					# Apply the segmentation on the keyframe and carve it without drawing, since it is a previous frame
+					rvecs, tvecs, keyframe_undist, keyframe_index = keyframe
+					undist_mask = apply_segmentation(obj, keyframe_undist)
+					if views_cache is not None: append_cached_view(views_cache, keyframe_index, rvecs, tvecs, undist_mask)
+					if processes > 1: pending_views.append((rvecs, tvecs, *pack_mask(undist_mask)))
+					else: pending_views.append((rvecs, tvecs, undist_mask))
+					pending_frames.append(keyframe_index)
+					if processes == 1 and len(pending_views) >= batch_size:
+						carved_voxels = carver.carve_views(pending_views, pending_frames)
+						pending_views, pending_frames = [], []
+
+				elif keyframe_selector is None:
+					# Apply the segmentation on the undistorted frame
+					undist_mask = apply_segmentation(obj, undist_frame)
+					if views_cache is not None: append_cached_view(views_cache, actual_fps, *voxels_cube.get_pose(), undist_mask)
+
+					if processes > 1:
+						# Store the frame to carve it at the end, packing the mask to limit the memory usage
+						pending_views.append((*voxels_cube.get_pose(), *pack_mask(undist_mask)))
+						pending_frames.append(actual_fps)
+					elif batch_size > 1 or visual_hull is not None:
+						# Carve the frames batch once it is full, the visual hull does not draw the carved frames
+						pending_views.append((*voxels_cube.get_pose(), undist_mask))
+						pending_frames.append(actual_fps)
+						if len(pending_views) == batch_size:
+							carved_voxels = carver.carve_views(pending_views, pending_frames)
+							pending_views, pending_frames = [], []
+					else:
+						# Update the binary array of foreground voxels and draw the background
+						foreground_voxels = voxels_cube.get_occupancy().count()
+						edited_frame = voxels_cube.set_background_voxels((frame_width, frame_height), undist_mask, edited_frame, actual_fps)
+						carved_voxels = foreground_voxels - voxels_cube.get_occupancy().count()
+
+				if convergence_monitor is not None and carved_voxels is not None: convergence_monitor.update_carved(carved_voxels)
     
 				
 			end = time.time()
@@ -165,29 +405,84 @@ def main(using_laptop: bool, voxel_cube_edge_dim: int) -> None:
    
 			actual_fps += 1
 
+			# Save the carving state every checkpoint_every frames
+			if checkpoint_every > 0 and actual_fps % checkpoint_every == 0:
+				if views_cache is not None: views_cache.flush()
+				save_checkpoint(checkpoint_dir, voxels_cube.get_occupancy().get_packed_bits(), voxels_cube.get_carved_at(),
+								dict(voxel_cube_edge_dim=voxel_cube_edge_dim, frame_index=actual_fps, avg_fps=avg_fps, avg_rmse=avg_rmse, board=board,
+									 prev_frameg=prev_frameg, processes=processes, pending_views=pending_views if processes == 1 else None,
+									 pending_frames=pending_frames if processes == 1 else None, pending_offset=pending_offset,
+									 views_offset=views_cache.tell() if views_cache is not None else None, keyframe_selector=keyframe_selector,
+									 convergence_monitor=convergence_monitor, pose_estimator=pose_estimator, completed=False))
+
 
 			key = cv.waitKey(1)
 			if key == ord('p'): cv.waitKey(-1) 
    
-			if key == ord('q'): return
-
+			if key == ord('q'):
+				voxels_cube.close()
+				return
+
+			# Skip the rest of the video once the hull has converged
+			if convergence_monitor is not None and convergence_monitor.has_converged():
+				print(f' converged at frame {actual_fps}...')
+				break
+
+
+		# Add the best frame of the last angular bucket
+		keyframe = keyframe_selector.flush() if keyframe_selector is not None else None
+		if keyframe is not None:
+			rvecs, tvecs, keyframe_undist, keyframe_index = keyframe
+			undist_mask = apply_segmentation(obj, keyframe_undist)
+			if views_cache is not None: append_cached_view(views_cache, keyframe_index, rvecs, tvecs, undist_mask)
+			pending_views.append((rvecs, tvecs, *pack_mask(undist_mask)) if processes > 1 else (rvecs, tvecs, undist_mask))
+			pending_frames.append(keyframe_index)
+
+		if processes > 1:
+			# Each process carves its own grid with a shard of frames, the result is the intersection of all the grids
+			print('Carving the frames in parallel...')
+			with ProcessPoolExecutor(max_workers=processes) as executor:
+				shards = [pending_views[shard::processes] for shard in range(processes)]
+				frames_shards = [pending_frames[shard::processes] for shard in range(processes)]
+				for occupancy, carved_at in executor.map(carve_views_shard, [voxels_cube_params] * processes, shards, [batch_size] * processes, frames_shards):
+					voxels_cube.intersect_occupancy(occupancy, carved_at)
+
+		# Carve the last incomplete frames batch
+		elif len(pending_views) > 0: carver.carve_views(pending_views, pending_frames)
 
 		print(' DONE')
-		print(f'Average FPS is: {str(avg_fps / int(input_video.get(cv.CAP_PROP_FRAME_COUNT)))}')
-		print(f'Average Reprojection RMS Pixel Error is: {str(avg_rmse / int(input_video.get(cv.CAP_PROP_FRAME_COUNT)))}')
+		print(f'Average FPS is: {str(avg_fps / max(actual_fps, 1))}')
+		print(f'Average Reprojection RMS Pixel Error is: {str(avg_rmse / max(actual_fps, 1))}')
 
 
 		# Release the input and output streams
 		input_video.release()
 		output_video.release()
+		if views_cache is not None: views_cache.close()
 		cv.destroyAllWindows()
 
 		print('Saving PLY file...')
   
 		# Get the voxels cube coordinates and faces to write a PLY file
-		voxels_cube_coords, voxels_cube_faces = voxels_cube.get_cubes_coords_and_faces()
+		voxels_cube_coords, voxels_cube_faces = carver.get_cubes_coords_and_faces()
 		# Save in a .ply file
-		write_ply_file(obj_id, voxels_cube_coords, voxels_cube_faces)
+		write_ply_file(obj_id, voxels_cube_coords, voxels_cube_faces, binary=not ascii_ply)
+
+		# Save the frame that carved each voxel, to rebuild the occupancy without some frames, or drop the one of a previous run if the views cache is rewritten
+		# The grid shape and box are saved with it, so that it is restored only on the same grid
+		carved_at_path = f'../output_project/{obj_id}/{obj_id}_carved_at.npz'
+		if visual_hull is None and voxels_cube.get_carved_at() is not None:
+			np.savez(carved_at_path, carved_at=voxels_cube.get_carved_at(), grid_shape=np.array(voxels_cube.get_occupancy().get_shape()),
+					 grid_bounds=np.stack(voxels_cube.get_grid_bounds()))
+		elif cache_views and os.path.exists(carved_at_path): os.remove(carved_at_path)
+
+		# Mark the object as completed, so that a resumed run skips it
+		if checkpoint_every > 0:
+			save_checkpoint(checkpoint_dir, voxels_cube.get_occupancy().get_packed_bits(), voxels_cube.get_carved_at(),
+							dict(voxel_cube_edge_dim=voxel_cube_edge_dim, frame_index=actual_fps, avg_fps=avg_fps, avg_rmse=avg_rmse, board=None,
+								 prev_frameg=None, processes=processes, pending_views=[], pending_frames=[], pending_offset=0, views_offset=None,
+								 keyframe_selector=None, convergence_monitor=None, pose_estimator=None, completed=True))
+		voxels_cube.close()
 		print(' DONE\n')
 
 
@@ -197,10 +492,33 @@ if __name__ == "__main__":
     # Get the console arguments
 	parser = argparse.ArgumentParser(prog='SpaceCarving', description='Space Carving Project')
 	parser.add_argument('--hd_laptop', dest='hd_laptop', default=False, action='store_true', help='Using a 720p resolution')
+	parser.add_argument('--hierarchical', dest='hierarchical', default=False, action='store_true', help='Carve coarse to fine, subdividing only the ambiguous cells of voxels')
+	parser.add_argument('--footprint', dest='footprint', default=False, action='store_true', help='Carve a voxel only when its whole projected footprint is background')
+	parser.add_argument('--batch_size', dest='batch_size', type=int, default=1, help='Number of frames carved together, testing each chunk of voxels with the frames in turn')
+	parser.add_argument('--fused', dest='fused', default=False, action='store_true', help='Project and carve the voxels with a single Numba compiled kernel')
+	parser.add_argument('--processes', dest='processes', type=int, default=1, help='Number of processes that carve a shard of the frames after the video is processed')
+	parser.add_argument('--threads', dest='threads', type=int, default=1, help='Number of threads that carve a chunk of the voxels of each frame')
+	parser.add_argument('--memory_budget_mb', dest='memory_budget_mb', type=int, default=None, help='Carve a tiled grid that keeps only the occupancy bits between frames, within this memory budget in MB')
+	parser.add_argument('--checkpoint_every', dest='checkpoint_every', type=int, default=0, help='Save the carving state every this number of frames')
+	parser.add_argument('--keyframe_degrees', dest='keyframe_degrees', type=float, default=None, help='Carve only the best frame of each angular bucket of this width in degrees')
+	parser.add_argument('--converge_patience', dest='converge_patience', type=int, default=None, help='Stop an object after the whole rotation once this number of consecutive carvings change the hull by less than --converge_min_voxels')
+	parser.add_argument('--converge_min_voxels', dest='converge_min_voxels', type=int, default=10, help='Number of carved voxels below which a carving does not change the hull')
+	parser.add_argument('--intervals', dest='intervals', default=False, action='store_true', help='Store each column of voxels as z intervals and carve it by sampling its projected segment')
+	parser.add_argument('--z_subdivisions', dest='z_subdivisions', type=int, default=1, help='Number of slices along z of each voxel of the column intervals carving')
+	parser.add_argument('--visual_hull', dest='visual_hull_step', type=float, default=None, help='Reconstruct with the silhouette contours of a grid of vertical rays with this spacing instead of the voxels')
+	parser.add_argument('--auto_box', dest='auto_box_frames', type=int, default=None, help='Fit the grid to the bounding box of the silhouettes of this number of widely spaced frames')
+	parser.add_argument('--provenance', dest='provenance', default=False, action='store_true', help='Record and save the frame that carved each voxel')
+	parser.add_argument('--cache_views', dest='cache_views', default=False, action='store_true', help='Save the pose and the silhouette of each segmented frame to carve them again with recarve.py')
+	parser.add_argument('--turntable', dest='turntable_frames', type=int, default=None, help='Estimate the camera to turntable transform from this number of first frames and then fit only the rotation angle of each frame')
+	parser.add_argument('--ascii_ply', dest='ascii_ply', default=False, action='store_true', help='Write the PLY file in ASCII instead of binary')
+	parser.add_argument('--resume', dest='resume', default=False, action='store_true', help='Continue each object from its last checkpoint')
 	parser.add_argument('voxel_cube_edge_dim', type=int, help='Dimension of a voxel cube edge')
 	args = parser.parse_args()
 	
 	if(args.voxel_cube_edge_dim < 0): raise ValueError('The voxel_cube_edge_dim must be a positive integer number')
+	if args.turntable_frames is not None and args.turntable_frames < 2: raise ValueError('The turntable option needs at least 2 frames')
 
-	main(args.hd_laptop, args.voxel_cube_edge_dim)
+	main(args.hd_laptop, args.voxel_cube_edge_dim, args.hierarchical, args.footprint, args.batch_size, args.fused, args.processes, args.threads, args.memory_budget_mb, args.checkpoint_every, args.resume, args.keyframe_degrees,
+		 args.converge_patience, args.converge_min_voxels, args.intervals, args.z_subdivisions,
+		 args.visual_hull_step, args.auto_box_frames, args.provenance, args.cache_views, args.turntable_frames, args.ascii_ply)
  
\ No newline at end of file
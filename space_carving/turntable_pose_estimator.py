@@ -0,0 +1,161 @@
+import numpy as np
+import cv2 as cv
+
+from typing import Tuple
+
+from utils import get_turntable_angle
+
+# Maximum angle in degrees between the board normal of a calibration frame and the median normal, to discard the flipped IPPE solutions
+max_normal_degrees = 5.0
+
+# Number of alternations between the fit of the camera to turntable transform and the fit of the rotation angles
+calibration_iterations = 3
+
+
+# TurntablePoseEstimator class that estimates once the fixed camera to turntable transform from the first frames, and then fits in closed form
+# only the rotation angle of the board around its z axis in each frame, instead of a full 6-DoF pose
+
+class TurntablePoseEstimator:
+
+	def __init__(self, camera_matrix, dist, calibration_frames) -> None:
+		self.__camera_matrix = camera_matrix
+		self.__dist = dist
+		self.__calibration_frames = calibration_frames
+		# Normalized image points, board points and IPPE pose of each calibration frame
+		self.__calibration_views = []
+		self.__turntable_rotation = None
+		self.__turntable_translation = None
+		self.__image_to_turntable = None
+
+
+
+
+	def is_calibrated(self) -> bool:
+		'''
+		PURPOSE: check if the camera to turntable transform is estimated
+		ARGUMENTS: None
+		RETURN:
+			- (bool): True once the calibration frames are collected
+		'''
+
+		return self.__turntable_rotation is not None
+
+
+
+
+	def get_turntable_pose(self) -> Tuple[np.ndarray[int, np.float64], np.ndarray[int, np.float64]] | None:
+		'''
+		PURPOSE: get the camera to turntable transform, that is the board pose at rotation angle 0
+		ARGUMENTS: None
+		RETURN:
+			- (Tuple[np.ndarray[int, np.float64], np.ndarray[int, np.float64]] | None): rotation matrix and translation vector, None if not calibrated
+		'''
+
+		if not self.is_calibrated(): return None
+
+		return self.__turntable_rotation, self.__turntable_translation
+
+
+
+
+	def __fit_angle(self, normalized_points: np.ndarray[int, np.float64], board_points: np.ndarray[int, np.float64]) -> float:
+		'''
+		PURPOSE: fit in closed form the rotation angle that maps the board points onto the back projection of the image points on the turntable plane
+		ARGUMENTS:
+			- normalized_points (np.ndarray[int, np.float64]): (N, 2) undistorted normalized image points
+			- board_points (np.ndarray[int, np.float64]): (N, 2) x, y board coordinates of the points
+		RETURN:
+			- (float): rotation angle in radians
+		'''
+
+		# The turntable plane z = 0 maps to the image with the homography [r1 r2 t], so its inverse back projects the points
+		turntable_points = normalized_points @ self.__image_to_turntable[:, :2].T + self.__image_to_turntable[:, 2]
+		turntable_points = turntable_points[:, :2] / turntable_points[:, 2:]
+
+		# Least squares 2D rotation around the turntable centre, from the sums of the cross and dot products of the point pairs
+		cross = np.sum(board_points[:, 0] * turntable_points[:, 1] - board_points[:, 1] * turntable_points[:, 0])
+		dot = np.sum(board_points * turntable_points)
+
+		return float(np.arctan2(cross, dot))
+
+
+
+
+	def __set_turntable_pose(self, rotation_matrix: np.ndarray[int, np.float64], translation: np.ndarray[int, np.float64]) -> None:
+		'''
+		PURPOSE: set the camera to turntable transform and the homography that back projects the normalized image points on the turntable plane
+		ARGUMENTS:
+			- rotation_matrix (np.ndarray[int, np.float64]): rotation matrix of the board at rotation angle 0
+			- translation (np.ndarray[int, np.float64]): translation vector of the board
+		RETURN: None
+		'''
+
+		self.__turntable_rotation = rotation_matrix
+		self.__turntable_translation = np.reshape(translation, (3, 1)).astype(np.float64)
+		self.__image_to_turntable = np.linalg.inv(np.column_stack((rotation_matrix[:, 0], rotation_matrix[:, 1], np.ravel(translation))))
+
+
+
+
+	def __calibrate(self) -> None:
+		'''
+		PURPOSE: estimate the camera to turntable transform from the calibration frames, alternating a single PnP on the points of all the frames
+			rotated by their angle and the closed form fit of the angles
+		ARGUMENTS: None
+		RETURN: None
+		'''
+
+		normals = np.array([cv.Rodrigues(rvecs)[0][:, 2] for _, _, rvecs, _ in self.__calibration_views])
+		median_normal = np.median(normals, axis=0)
+		median_normal /= np.linalg.norm(median_normal)
+		views = [view for view, normal in zip(self.__calibration_views, normals) if np.degrees(np.arccos(np.clip(normal @ median_normal, -1, 1))) <= max_normal_degrees]
+		if len(views) == 0: views = self.__calibration_views
+
+		# The first frame sets the rotation angle 0, the turntable centre is the board origin
+		first_rotation = cv.Rodrigues(views[0][2])[0]
+		angles = [np.radians(get_turntable_angle(first_rotation, rvecs)) for _, _, rvecs, _ in views]
+		rvecs, tvecs = views[0][2].astype(np.float64), np.mean([np.ravel(tvecs) for _, _, _, tvecs in views], axis=0).reshape(3, 1)
+
+		normalized_points = np.concatenate([view[0] for view in views])
+		for _ in range(calibration_iterations):
+			# Board points of each frame in the turntable reference frame
+			turntable_points = np.concatenate([np.column_stack((board_points[:, 0] * np.cos(angle) - board_points[:, 1] * np.sin(angle),
+																board_points[:, 0] * np.sin(angle) + board_points[:, 1] * np.cos(angle),
+																np.zeros(board_points.shape[0])))
+											   for (_, board_points, _, _), angle in zip(views, angles)])
+			_, rvecs, tvecs = cv.solvePnP(objectPoints=turntable_points, imagePoints=normalized_points, cameraMatrix=np.eye(3), distCoeffs=None,
+										  rvec=rvecs, tvec=tvecs, useExtrinsicGuess=True, flags=cv.SOLVEPNP_ITERATIVE)
+			self.__set_turntable_pose(cv.Rodrigues(rvecs)[0], tvecs)
+			angles = [self.__fit_angle(view_points, board_points) for view_points, board_points, _, _ in views]
+
+		self.__calibration_views = []
+
+
+
+
+	def estimate_pose(self, twoD_points: np.ndarray[int, np.float32], threeD_points: np.ndarray[int, np.float32]) \
+			-> Tuple[np.ndarray[int, np.float64], np.ndarray[int, np.float64]]:
+		'''
+		PURPOSE: estimate the board pose of a frame, with a full PnP until the calibration frames are collected and then with the rotation angle only
+		ARGUMENTS:
+			- twoD_points (np.ndarray[int, np.float32]): detected marker points
+			- threeD_points (np.ndarray[int, np.float32]): board coordinates of the marker points, on the plane z = 0
+		RETURN: Tuple[np.ndarray[int, np.float64], np.ndarray[int, np.float64]]
+			- rvecs (np.ndarray[int, np.float64]): rotation vector
+			- tvecs (np.ndarray[int, np.float64]): translation vector
+		'''
+
+		normalized_points = cv.undistortPoints(np.reshape(twoD_points, (-1, 1, 2)).astype(np.float64), self.__camera_matrix, self.__dist).reshape(-1, 2)
+		board_points = np.asarray(threeD_points, dtype=np.float64)[:, :2]
+
+		if not self.is_calibrated():
+			_, rvecs, tvecs = cv.solvePnP(objectPoints=threeD_points.astype('float32'), imagePoints=twoD_points.astype('float32'),
+										  cameraMatrix=self.__camera_matrix, distCoeffs=self.__dist, flags=cv.SOLVEPNP_IPPE)
+			self.__calibration_views.append((normalized_points, board_points, rvecs, tvecs))
+			if len(self.__calibration_views) >= self.__calibration_frames: self.__calibrate()
+			return rvecs, tvecs
+
+		angle = self.__fit_angle(normalized_points, board_points)
+		rotation_matrix = self.__turntable_rotation @ np.array([[np.cos(angle), -np.sin(angle), 0], [np.sin(angle), np.cos(angle), 0], [0, 0, 1]])
+
+		return cv.Rodrigues(rotation_matrix)[0], self.__turntable_translation.copy()
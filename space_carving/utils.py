@@ -3,8 +3,16 @@ from types import NoneType
 import cv2 as cv
 import numpy as np
 import random
+import os
+import pickle
 
-from typing import Dict, List, Tuple
+from typing import Any, BinaryIO, Dict, Iterator, List, Tuple
+
+# Number of vertices or faces converted and written at once in a binary PLY file
+ply_chunk_elements = 1 << 20
+
+# Number of bytes compared at once with the previous checkpoint
+checkpoint_chunk_bytes = 1 << 24
 
 
 
@@ -195,33 +203,460 @@ def resize_for_laptop(using_laptop: bool, frame: np.ndarray[int, np.uint8]) -> n
 
 
 
-def write_ply_file(obj_id: str, voxels_cube_coords: np.ndarray[int, np.float32], voxels_cube_faces: np.ndarray[int, np.float32]) -> None:
+def seek_video_frame(input_video: cv.VideoCapture, frame_index: int) -> None:
+	'''
+	PURPOSE: move the video to a frame, skipping the frames one by one from the start if the seek is inexact on the codec
+	ARGUMENTS:
+		- input_video (cv.VideoCapture): video to seek
+		- frame_index (int): index of the next frame read
+	RETURN: None
+	'''
+
+	input_video.set(cv.CAP_PROP_POS_FRAMES, frame_index)
+	if int(input_video.get(cv.CAP_PROP_POS_FRAMES)) != frame_index:
+		input_video.set(cv.CAP_PROP_POS_FRAMES, 0)
+		for _ in range(frame_index): input_video.grab()
+
+
+
+
+def write_ply_file(obj_id: str, voxels_cube_coords: np.ndarray[int, np.float32], voxels_cube_faces: np.ndarray[int, np.int32], suffix = '', binary = True) -> None:
 	'''
-	PURPOSE: write the .ply file that compose the object mesh
+	PURPOSE: write the .ply file that compose the object mesh, streaming the vertices and the faces in chunks
 	ARGUMENTS:
 		- obj_id (str)
 		- voxels_cube_coords (np.ndarray[int, np.float32]): array of voxels cube coordinates
-		- voxels_cube_faces (np.ndarray[int, np.float32]): array of voxels faces
+		- voxels_cube_faces (np.ndarray[int, np.int32]): array of voxels faces, number of vertices followed by the vertices ID
+		- suffix (str): suffix of the file name, to write more meshes of the same object
+		- binary (bool): boolean variable to write a binary little endian file instead of an ASCII one
 	RETURN: None
 	'''	
 
-    # Create the header
-	header = f"""ply
-	format ascii 1.0
-	element vertex {voxels_cube_coords.shape[0]}
-	property float x
-	property float y
-	property float z
- 	element face {voxels_cube_faces.shape[0]}
-	property list uchar int vertex_index
-	end_header
-	"""
-
-	# Write header and vertex data to a file
-	with open(f'../output_project/{obj_id}/3d_{obj_id}.ply', 'w') as f:
-		f.write(header)
-		np.savetxt(f, voxels_cube_coords, fmt='%.4f', newline='\n')
-  
-	# Write face data to the same file
-	with open(f'../output_project/{obj_id}/3d_{obj_id}.ply', 'a') as f:
-		np.savetxt(f, voxels_cube_faces.astype(int), fmt='%i', newline='\n')
+	# Create the header
+	header = '\n'.join((
+		'ply',
+		f'format {"binary_little_endian" if binary else "ascii"} 1.0',
+		f'element vertex {voxels_cube_coords.shape[0]}',
+		'property float x',
+		'property float y',
+		'property float z',
+		f'element face {voxels_cube_faces.shape[0]}',
+		'property list uchar int vertex_index',
+		'end_header'
+	)) + '\n'
+
+	with open(f'../output_project/{obj_id}/3d_{obj_id}{suffix}.ply', 'wb') as f:
+		f.write(header.encode('ascii'))
+
+		if not binary:
+			np.savetxt(f, voxels_cube_coords, fmt='%.4f', newline='\n')
+			np.savetxt(f, voxels_cube_faces.astype(int), fmt='%i', newline='\n')
+			return
+
+		# Each face is a packed record of the uchar vertices count and the int vertices ID
+		face_dtype = np.dtype([('count', '<u1'), ('vertices', '<i4', (voxels_cube_faces.shape[1] - 1,))])
+
+		for first in range(0, voxels_cube_coords.shape[0], ply_chunk_elements):
+			np.ascontiguousarray(voxels_cube_coords[first:first + ply_chunk_elements], dtype='<f4').tofile(f)
+
+		for first in range(0, voxels_cube_faces.shape[0], ply_chunk_elements):
+			faces_chunk = voxels_cube_faces[first:first + ply_chunk_elements]
+			records = np.empty(faces_chunk.shape[0], dtype=face_dtype)
+			records['count'], records['vertices'] = faces_chunk[:, 0], faces_chunk[:, 1:]
+			records.tofile(f)
+
+
+
+
+def get_foreground_integral_image(mask: np.ndarray[int, np.uint8]) -> np.ndarray[int, np.int32]:
+	'''
+	PURPOSE: compute the summed-area table of the foreground pixels of a segmentation mask
+	ARGUMENTS:
+		- mask (np.ndarray[int, np.uint8]): segmentation mask, foreground pixels are non zero
+	RETURN:
+		- (np.ndarray[int, np.int32]): (H + 1, W + 1) integral image of the foreground pixels count
+	'''	
+
+	return cv.integral(np.uint8(mask > 0))
+
+
+
+
+# The 5x5 chamfer distance overestimates the euclidean distance by less than this factor
+chamfer_distance_error = 1.05
+
+
+
+def get_silhouette_distances(mask: np.ndarray[int, np.uint8], background = True) -> Tuple[np.ndarray[int, np.float32], np.ndarray[int, np.float32] | None]:
+	'''
+	PURPOSE: compute a lower bound of the euclidean distance of each pixel of a segmentation mask from the silhouette boundary,
+		using the 5x5 chamfer distance transform that is much faster than the exact one
+	ARGUMENTS:
+		- mask (np.ndarray[int, np.uint8]): segmentation mask, foreground pixels are non zero
+		- background (bool): boolean variable to indicate to compute also the distances of the background pixels
+	RETURN: Tuple[np.ndarray[int, np.float32], np.ndarray[int, np.float32] | None]
+		- (np.ndarray[int, np.float32]): distance of each foreground pixel from the closest background pixel, 0 on the background
+		- (np.ndarray[int, np.float32] | None): distance of each background pixel from the closest foreground pixel, 0 on the foreground
+	'''	
+
+	foreground = np.uint8(mask > 0)
+	foreground_distance = cv.distanceTransform(foreground, cv.DIST_L2, cv.DIST_MASK_5) / np.float32(chamfer_distance_error)
+	if not background: return foreground_distance, None
+
+	return foreground_distance, cv.distanceTransform(1 - foreground, cv.DIST_L2, cv.DIST_MASK_5) / np.float32(chamfer_distance_error)
+
+
+
+
+def count_foreground_in_rects(integral_image: np.ndarray[int, np.int32], x_min: np.ndarray[int, np.int32], y_min: np.ndarray[int, np.int32],
+							  x_max: np.ndarray[int, np.int32], y_max: np.ndarray[int, np.int32]) -> np.ndarray[int, np.int32]:
+	'''
+	PURPOSE: count in O(1) per rectangle the foreground pixels inside a set of rectangles lying inside the image
+	ARGUMENTS:
+		- integral_image (np.ndarray[int, np.int32]): integral image returned by get_foreground_integral_image
+		- x_min (np.ndarray[int, np.int32]): first column of each rectangle
+		- y_min (np.ndarray[int, np.int32]): first row of each rectangle
+		- x_max (np.ndarray[int, np.int32]): last column of each rectangle (inclusive)
+		- y_max (np.ndarray[int, np.int32]): last row of each rectangle (inclusive)
+	RETURN:
+		- (np.ndarray[int, np.int32]): number of foreground pixels inside each rectangle
+	'''	
+
+	return integral_image[y_max + 1, x_max + 1] - integral_image[y_min, x_max + 1] - integral_image[y_max + 1, x_min] + integral_image[y_min, x_min]
+
+
+
+
+def fill_rects_mask(shape: Tuple[int, int], x_min: np.ndarray[int, np.int32], y_min: np.ndarray[int, np.int32],
+					x_max: np.ndarray[int, np.int32], y_max: np.ndarray[int, np.int32]) -> np.ndarray[int, np.bool_]:
+	'''
+	PURPOSE: obtain in a single step the mask covered by a set of rectangles lying inside the image
+	ARGUMENTS:
+		- shape (Tuple[int, int]): height and width of the mask
+		- x_min (np.ndarray[int, np.int32]): first column of each rectangle
+		- y_min (np.ndarray[int, np.int32]): first row of each rectangle
+		- x_max (np.ndarray[int, np.int32]): last column of each rectangle (inclusive)
+		- y_max (np.ndarray[int, np.int32]): last row of each rectangle (inclusive)
+	RETURN:
+		- (np.ndarray[int, np.bool_]): True where at least one rectangle covers the pixel
+	'''	
+
+	# Accumulate the rectangles corners in a difference image and integrate it along both axes, the counts are exact in float32
+	diff = np.zeros((shape[0] + 1, shape[1] + 1), dtype=np.float32)
+	np.add.at(diff, (y_min, x_min), 1)
+	np.add.at(diff, (y_min, x_max + 1), -1)
+	np.add.at(diff, (y_max + 1, x_min), -1)
+	np.add.at(diff, (y_max + 1, x_max + 1), 1)
+
+	return cv.integral(diff, sdepth=cv.CV_32F)[1:shape[0] + 1, 1:shape[1] + 1] > 0.5
+
+
+
+
+def project_camera_points(camera_points: np.ndarray[int, np.float64], camera_matrix: np.ndarray[int, np.float64], dist: np.ndarray[int, np.float64]) \
+		-> np.ndarray[int, np.float64]:
+	'''
+	PURPOSE: project points already expressed in the camera reference frame applying the same distortion model of cv.projectPoints
+	ARGUMENTS:
+		- camera_points (np.ndarray[int, np.float64]): (..., 3) points in the camera reference frame
+		- camera_matrix (np.ndarray[int, np.float64]): camera intrinsic matrix
+		- dist (np.ndarray[int, np.float64]): distortion coefficients (k1, k2, p1, p2[, k3[, k4, k5, k6[, s1, s2, s3, s4]]])
+	RETURN:
+		- (np.ndarray[int, np.float64]): (..., 2) image points
+	'''
+
+	k1, k2, p1, p2, k3, k4, k5, k6, s1, s2, s3, s4 = np.pad(np.ravel(dist).astype(np.float64), (0, 12))[:12]
+
+	# Normalized image coordinates
+	x = camera_points[..., 0] / camera_points[..., 2]
+	y = camera_points[..., 1] / camera_points[..., 2]
+
+	# Radial, tangential and thin prism distortion
+	r2 = x * x + y * y
+	r4 = r2 * r2
+	radial = (1 + r2 * (k1 + r2 * (k2 + r2 * k3))) / (1 + r2 * (k4 + r2 * (k5 + r2 * k6)))
+	x_dist = x * radial + 2 * p1 * x * y + p2 * (r2 + 2 * x * x) + s1 * r2 + s2 * r4
+	y_dist = y * radial + p1 * (r2 + 2 * y * y) + 2 * p2 * x * y + s3 * r2 + s4 * r4
+
+	return np.stack((camera_matrix[0, 0] * x_dist + camera_matrix[0, 2], camera_matrix[1, 1] * y_dist + camera_matrix[1, 2]), axis=-1)
+
+
+
+
+def get_projection_stretch_bound(camera_matrix: np.ndarray[int, np.float64], dist: np.ndarray[int, np.float64], resolution: Tuple[int, int], samples = 64) \
+		-> Tuple[float, np.ndarray[int, np.float64], float]:
+	'''
+	PURPOSE: bound how much the distorted projection can stretch a displacement of the normalized image coordinates, in the region seen by the camera
+	ARGUMENTS:
+		- camera_matrix (np.ndarray[int, np.float64]): camera intrinsic matrix
+		- dist (np.ndarray[int, np.float64]): distortion coefficients
+		- resolution (Tuple[int, int]): image resolution
+		- samples (int): number of samples along each side of the region
+	RETURN: Tuple[float, np.ndarray[int, np.float64], float]
+		- stretch (float): maximum pixels displacement for a unit displacement of the normalized coordinates
+		- box (np.ndarray[int, np.float64]): (2, 2) lower and upper normalized coordinates of the image
+		- max_displacement (float): maximum normalized displacement from a point of the box for which the bound holds
+	'''
+
+	width, height = resolution
+
+	# Normalized coordinates of the image border
+	along_x, along_y = np.linspace(0, width, samples), np.linspace(0, height, samples)
+	border = np.concatenate((np.stack((along_x, np.zeros(samples)), axis=1), np.stack((along_x, np.full(samples, height)), axis=1),
+							 np.stack((np.zeros(samples), along_y), axis=1), np.stack((np.full(samples, width), along_y), axis=1)))
+	normalized = np.reshape(cv.undistortPoints(np.reshape(border, (-1, 1, 2)), camera_matrix, dist), (-1, 2))
+	box = np.stack((normalized.min(axis=0), normalized.max(axis=0)))
+
+	# Sample the jacobian of the projection in the box enlarged by the maximum displacement
+	max_displacement = 0.5 * np.min(box[1] - box[0])
+	xs, ys = np.meshgrid(np.linspace(box[0, 0] - max_displacement, box[1, 0] + max_displacement, samples),
+						 np.linspace(box[0, 1] - max_displacement, box[1, 1] + max_displacement, samples))
+	points = np.stack((xs, ys, np.ones_like(xs)), axis=-1)
+	step = 1e-6
+	imgpts = project_camera_points(points, camera_matrix, dist)
+	jacobian = np.stack(((project_camera_points(points + [step, 0, 0], camera_matrix, dist) - imgpts) / step,
+						 (project_camera_points(points + [0, step, 0], camera_matrix, dist) - imgpts) / step), axis=-1)
+
+	# Largest singular value of the sampled jacobians, with a safety margin for the points between the samples
+	stretch = 1.25 * np.linalg.norm(np.reshape(jacobian, (-1, 2, 2)), ord=2, axis=(1, 2)).max()
+
+	return float(stretch), box, float(max_displacement)
+
+
+
+
+def get_turntable_angle(first_rotation: np.ndarray[int, np.float64], rvecs: np.ndarray[int, np.float64]) -> float:
+	'''
+	PURPOSE: get the board rotation angle around its normal with respect to a reference pose, for a still camera looking at the turntable
+	ARGUMENTS:
+		- first_rotation (np.ndarray[int, np.float64]): rotation matrix of the board in the reference frame
+		- rvecs (np.ndarray[int, np.float64]): rotation vector of the board in the actual frame
+	RETURN:
+		- (float): rotation angle in degrees in [0, 360)
+	'''
+
+	# With a still camera the relative rotation is a rotation around the board z axis
+	relative_rotation = first_rotation.T @ cv.Rodrigues(rvecs)[0]
+
+	return float(np.degrees(np.arctan2(relative_rotation[1, 0], relative_rotation[0, 0])) % 360)
+
+
+
+
+def subtract_intervals(starts: np.ndarray[int, np.int64], ends: np.ndarray[int, np.int64], cut_starts: np.ndarray[int, np.int64],
+					   cut_ends: np.ndarray[int, np.int64]) -> Tuple[np.ndarray[int, np.int64], np.ndarray[int, np.int64]]:
+	'''
+	PURPOSE: remove from a set of disjoint half open intervals the union of other intervals, that may overlap, sweeping all the interval
+		boundaries at once with a single cumulative sum of weighted events
+	ARGUMENTS:
+		- starts (np.ndarray[int, np.int64]): first position of each interval
+		- ends (np.ndarray[int, np.int64]): position after the end of each interval
+		- cut_starts (np.ndarray[int, np.int64]): first position of each interval to remove
+		- cut_ends (np.ndarray[int, np.int64]): position after the end of each interval to remove
+	RETURN: Tuple[np.ndarray[int, np.int64], np.ndarray[int, np.int64]]
+		- (np.ndarray[int, np.int64]): sorted first position of each remaining interval
+		- (np.ndarray[int, np.int64]): position after the end of each remaining interval
+	'''
+
+	if cut_starts.shape[0] == 0: return starts, ends
+
+	# An interval adds 1 to the level and a cut subtracts 2, so a position is kept only where the level is exactly 1
+	positions, inverse = np.unique(np.concatenate((starts, ends, cut_starts, cut_ends)), return_inverse=True)
+	weights = np.concatenate((np.ones_like(starts), -np.ones_like(ends), np.full_like(cut_starts, -2), np.full_like(cut_ends, 2)))
+	level = np.cumsum(np.bincount(inverse, weights=weights, minlength=positions.shape[0]))[:-1]
+
+	# Merge the kept segments between consecutive positions
+	kept = np.concatenate(([False], level == 1, [False]))
+	first, last = kept[1:-1] & ~kept[:-2], kept[1:-1] & ~kept[2:]
+
+	return positions[:-1][first], positions[1:][last]
+
+
+
+
+def get_boxes_coords_and_faces(lower: np.ndarray[int, np.float64], upper: np.ndarray[int, np.float64], lattice_step: float | None = None) \
+		-> Tuple[np.ndarray[int, np.float32], np.ndarray[int, np.int32]]:
+	'''
+	PURPOSE: get the vertices and the quadrilateral faces of a set of axis aligned boxes to write a PLY file, all the boxes at once
+	ARGUMENTS:
+		- lower (np.ndarray[int, np.float64]): (M, 3) lower x, y, z coordinates of each box
+		- upper (np.ndarray[int, np.float64]): (M, 3) upper x, y, z coordinates of each box
+		- lattice_step (float | None): step of the lattice where all the box corners lie, to write only once the corners shared by neighbouring boxes,
+			None to write 8 vertices for each box
+	RETURN: Tuple[np.ndarray[int, np.float32], np.ndarray[int, np.int32]]
+		- boxes_coords (np.ndarray[int, np.float32]): (V, 3) vertices coordinates, V = M * 8 without the lattice
+		- boxes_faces (np.ndarray[int, np.int32]): (M * 6, 5) number of vertices and vertices ID of each face
+	'''
+
+	# Vertices of each box in the order used by the faces, True for the upper coordinate
+	corners_selector = np.array([
+		[1, 1, 1], [1, 1, -1], [1, -1, 1], [1, -1, -1],
+		[-1, 1, 1], [-1, 1, -1], [-1, -1, 1], [-1, -1, -1]
+	]) > 0
+	boxes_coords = np.reshape(np.where(corners_selector, upper[:, np.newaxis, :], lower[:, np.newaxis, :]), (-1, 3))
+	vertices_id = np.arange(boxes_coords.shape[0], dtype=np.int32)
+
+	if lattice_step is not None and boxes_coords.shape[0] > 0:
+		# The corners are identified by their integer lattice position, so the vertices shared by neighbouring boxes are merged exactly
+		lattice = np.rint((boxes_coords - boxes_coords.min(axis=0)) / lattice_step).astype(np.int64)
+		keys = np.ravel_multi_index(tuple(lattice.T), tuple(lattice.max(axis=0) + 1))
+		_, first_corner, vertices_id = np.unique(keys, return_index=True, return_inverse=True)
+		boxes_coords, vertices_id = boxes_coords[first_corner], vertices_id.astype(np.int32)
+
+	# Broadcast the faces of a single box over the vertices ID of every box
+	box_faces = np.array([[2, 0, 1, 3], [6, 4, 5, 7], [6, 4, 0, 2], [7, 5, 1, 3], [0, 4, 5, 1], [2, 6, 7, 3]], dtype=np.int32)
+	boxes_faces = np.reshape(np.reshape(vertices_id, (-1, 8))[:, box_faces], (-1, 4))
+
+	return boxes_coords.astype(np.float32), np.hstack((np.full((boxes_faces.shape[0], 1), 4, dtype=np.int32), boxes_faces))
+
+
+
+
+def pack_mask(mask: np.ndarray[int, np.uint8]) -> Tuple[np.ndarray[int, np.uint8], Tuple[int, int]]:
+	'''
+	PURPOSE: pack a segmentation mask storing one bit per pixel
+	ARGUMENTS:
+		- mask (np.ndarray[int, np.uint8]): segmentation mask, foreground pixels are non zero
+	RETURN: Tuple[np.ndarray[int, np.uint8], Tuple[int, int]]
+		- (np.ndarray[int, np.uint8]): packed mask
+		- (Tuple[int, int]): mask shape
+	'''	
+
+	return np.packbits(mask > 0), mask.shape
+
+
+
+
+def unpack_mask(packed_mask: np.ndarray[int, np.uint8], mask_shape: Tuple[int, int]) -> np.ndarray[int, np.uint8]:
+	'''
+	PURPOSE: unpack a segmentation mask packed by pack_mask
+	ARGUMENTS:
+		- packed_mask (np.ndarray[int, np.uint8]): packed mask
+		- mask_shape (Tuple[int, int]): mask shape
+	RETURN:
+		- (np.ndarray[int, np.uint8]): segmentation mask with foreground pixels equal to 255
+	'''	
+
+	return np.reshape(np.unpackbits(packed_mask, count=mask_shape[0] * mask_shape[1]), mask_shape) * np.uint8(255)
+
+
+
+
+def write_changed_npy(npy_path: str, array: np.ndarray[int, Any]) -> None:
+	'''
+	PURPOSE: write an array in a memory mapped .npy file, reusing the file if it has the same shape and type and writing only the entries
+		changed since the last write, so that only the pages holding them become dirty and are written back
+	ARGUMENTS:
+		- npy_path (str): path of the .npy file
+		- array (np.ndarray[int, Any]): one dimensional array to write
+	RETURN: None
+	'''	
+
+	reuse = False
+	if os.path.exists(npy_path):
+		previous = np.load(npy_path, mmap_mode='r')
+		reuse = previous.shape == array.shape and previous.dtype == array.dtype
+		del previous
+
+	stored = np.lib.format.open_memmap(npy_path, mode='r+' if reuse else 'w+', dtype=array.dtype, shape=array.shape)
+	if reuse:
+		chunk_entries = max(1, checkpoint_chunk_bytes // array.itemsize)
+		for start in range(0, array.shape[0], chunk_entries):
+			changed = start + np.flatnonzero(stored[start:start + chunk_entries] != array[start:start + chunk_entries])
+			stored[changed] = array[changed]
+	else: stored[:] = array
+	stored.flush()
+	del stored
+
+
+
+
+def save_checkpoint(checkpoint_dir: str, packed_bits: np.ndarray[int, np.uint8], carved_at: np.ndarray[int, np.uint16] | None, state: Dict[str, Any]) -> None:
+	'''
+	PURPOSE: save the carving state, the occupancy bits and the carve provenance in memory mapped .npy files and the frame index with the tracker state in a side file
+	ARGUMENTS:
+		- checkpoint_dir (str): checkpoint directory
+		- packed_bits (np.ndarray[int, np.uint8]): packed occupancy bits
+		- carved_at (np.ndarray[int, np.uint16] | None): frame that carved each voxel, None if the provenance is not recorded
+		- state (Dict[str, Any]): picklable state of the carving loop
+	RETURN: None
+	'''	
+
+	os.makedirs(checkpoint_dir, exist_ok=True)
+	write_changed_npy(os.path.join(checkpoint_dir, 'occupancy.npy'), packed_bits)
+
+	carved_at_path = os.path.join(checkpoint_dir, 'carved_at.npy')
+	if carved_at is not None: write_changed_npy(carved_at_path, carved_at)
+	elif os.path.exists(carved_at_path): os.remove(carved_at_path)
+
+	# The side file is replaced atomically after the .npy files are flushed, since carving again some frames on a
+	# grid that is already carved by them does not change the result, an interruption in between is harmless
+	state_path = os.path.join(checkpoint_dir, 'state.pkl')
+	with open(state_path + '.tmp', 'wb') as f:
+		pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+	os.replace(state_path + '.tmp', state_path)
+
+
+
+
+def load_checkpoint(checkpoint_dir: str) -> Tuple[np.ndarray[int, np.uint8] | None, np.ndarray[int, np.uint16] | None, Dict[str, Any] | None]:
+	'''
+	PURPOSE: load the carving state saved by save_checkpoint
+	ARGUMENTS:
+		- checkpoint_dir (str): checkpoint directory
+	RETURN: Tuple[np.ndarray[int, np.uint8] | None, np.ndarray[int, np.uint16] | None, Dict[str, Any] | None]
+		- (np.ndarray[int, np.uint8] | None): memory mapped packed occupancy bits, None if there is no checkpoint
+		- (np.ndarray[int, np.uint16] | None): memory mapped carve provenance, None if there is no checkpoint or it is not recorded
+		- (Dict[str, Any] | None): state of the carving loop, None if there is no checkpoint
+	'''	
+
+	occupancy_path, state_path = os.path.join(checkpoint_dir, 'occupancy.npy'), os.path.join(checkpoint_dir, 'state.pkl')
+	if not os.path.exists(occupancy_path) or not os.path.exists(state_path): return None, None, None
+
+	with open(state_path, 'rb') as f:
+		state = pickle.load(f)
+
+	carved_at_path = os.path.join(checkpoint_dir, 'carved_at.npy')
+	carved_at = np.load(carved_at_path, mmap_mode='r') if os.path.exists(carved_at_path) else None
+
+	return np.load(occupancy_path, mmap_mode='r'), carved_at, state
+
+
+
+
+def append_cached_view(views_cache: BinaryIO, frame_index: int, rvecs: np.ndarray[int, np.float64], tvecs: np.ndarray[int, np.float64],
+					   mask: np.ndarray[int, np.uint8]) -> None:
+	'''
+	PURPOSE: append the pose and the packed silhouette of a frame to the views cache, so that the object can be carved again without the video
+	ARGUMENTS:
+		- views_cache (BinaryIO): views cache file opened in binary write or append mode
+		- frame_index (int): index of the frame in the video
+		- rvecs (np.ndarray[int, np.float64]): rotation vector
+		- tvecs (np.ndarray[int, np.float64]): translation vector
+		- mask (np.ndarray[int, np.uint8]): undistorted segmentation mask
+	RETURN: None
+	'''	
+
+	pickle.dump((frame_index, rvecs, tvecs, *pack_mask(mask)), views_cache, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+
+
+def load_cached_views(cache_path: str, start_offset = 0) -> Iterator[Tuple[int, np.ndarray[int, np.float64], np.ndarray[int, np.float64], np.ndarray[int, np.uint8]]]:
+	'''
+	PURPOSE: read one by one the views appended by append_cached_view
+	ARGUMENTS:
+		- cache_path (str): views cache file
+		- start_offset (int): byte offset of the first view read, at the start of a record
+	RETURN:
+		- (Iterator[Tuple[int, np.ndarray[int, np.float64], np.ndarray[int, np.float64], np.ndarray[int, np.uint8]]]): frame index, rotation vector,
+			translation vector and undistorted segmentation mask of each cached frame
+	'''	
+
+	with open(cache_path, 'rb') as f:
+		f.seek(start_offset)
+		while True:
+			# An interrupted run may leave the last view incomplete
+			try: frame_index, rvecs, tvecs, packed_mask, mask_shape = pickle.load(f)
+			except (EOFError, pickle.UnpicklingError): return
+			yield frame_index, rvecs, tvecs, unpack_mask(packed_mask, mask_shape)
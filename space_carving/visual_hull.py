@@ -0,0 +1,190 @@
+import numpy as np
+import cv2 as cv
+
+from typing import List, Tuple
+
+from utils import get_boxes_coords_and_faces, subtract_intervals
+
+# Maximum distance in pixels between the silhouette contours and their polygonal approximation
+contour_epsilon = 0.5
+
+# Maximum number of ray and contour edge pairs intersected at once
+intersection_chunk_pairs = 1 << 22
+
+
+# VisualHull class that reconstruct the object as the depth intervals of a regular grid of vertical rays, intersecting the projection
+# of each ray with the silhouette contours of each frame instead of testing the voxels of a dense grid
+
+class VisualHull:
+
+	def __init__(self, cube_half_edge, sampling_step, camera_matrix, dist, bounding_box = None) -> None:
+		self.__sampling_step = sampling_step
+		self.__camera_matrix = camera_matrix
+		self.__dist = dist
+		# The rays fill the cube above the board by default, or a tighter box estimated from the silhouettes
+		if bounding_box is None: bounding_box = ([-cube_half_edge, -cube_half_edge, 70], [cube_half_edge, cube_half_edge, 70 + cube_half_edge * 2])
+		lower, upper = np.asarray(bounding_box[0], dtype=np.float64), np.asarray(bounding_box[1], dtype=np.float64)
+		# Number of rays along the y and x axes
+		self.__rays_shape = tuple(int(round(rays)) for rays in ((upper[:2] - lower[:2]) / sampling_step)[::-1])
+		self.__z_low = lower[2]
+		self.__height = upper[2] - lower[2]
+		# The rays are vertical lines through the centre of each cell of the sampling grid, the ray j * x rays + i is at the cell [j, i]
+		cells_centres_x = lower[0] + (np.arange(self.__rays_shape[1]) + 0.5) * sampling_step
+		cells_centres_y = lower[1] + (np.arange(self.__rays_shape[0]) + 0.5) * sampling_step
+		self.__rays_xy = np.stack(np.meshgrid(cells_centres_x, cells_centres_y, indexing='xy'), axis=-1).reshape(-1, 2)
+		# Each ray owns a range of positions longer than its height, so that the intervals of consecutive rays never touch
+		self.__stride = self.__height + 1
+		self.__starts = np.arange(self.__rays_xy.shape[0], dtype=np.float64) * self.__stride
+		self.__ends = self.__starts + self.__height
+
+
+
+
+	def get_intervals(self) -> Tuple[np.ndarray[int, np.int64], np.ndarray[int, np.float64], np.ndarray[int, np.float64]]:
+		'''
+		PURPOSE: get the occupied depth intervals of the rays
+		ARGUMENTS: None
+		RETURN: Tuple[np.ndarray[int, np.int64], np.ndarray[int, np.float64], np.ndarray[int, np.float64]]
+			- (np.ndarray[int, np.int64]): ray of each interval, equal to y * x rays + x
+			- (np.ndarray[int, np.float64]): lower z coordinate of each interval
+			- (np.ndarray[int, np.float64]): upper z coordinate of each interval
+		'''
+
+		rays = (self.__starts // self.__stride).astype(np.int64)
+
+		return rays, self.__z_low + self.__starts - rays * self.__stride, self.__z_low + self.__ends - rays * self.__stride
+
+
+
+
+	def __get_background_edges(self, undist_b_f_image: np.ndarray[int, np.uint8]) -> Tuple[np.ndarray[int, np.float64], np.ndarray[int, np.float64]]:
+		'''
+		PURPOSE: get the edges of the polygonal contours of the background regions, in normalized image coordinates without distortion
+			so that the projection of each ray is a straight line
+		ARGUMENTS:
+			- undist_b_f_image (np.ndarray[int, np.uint8]): undistorted segmented frame
+		RETURN: Tuple[np.ndarray[int, np.float64], np.ndarray[int, np.float64]]
+			- (np.ndarray[int, np.float64]): first point of each edge
+			- (np.ndarray[int, np.float64]): second point of each edge
+		'''
+
+		# The background regions never leave the image, so the points outside the image are kept as in the voxels carving
+		contours, _ = cv.findContours(np.uint8(undist_b_f_image == 0), cv.RETR_LIST, cv.CHAIN_APPROX_SIMPLE)
+		contours = [polygon for polygon in (cv.approxPolyDP(contour, contour_epsilon, True) for contour in contours) if polygon.shape[0] > 2]
+		if len(contours) == 0: return np.zeros((0, 2)), np.zeros((0, 2))
+
+		# The contours pass through the centre of the boundary pixels
+		points = np.concatenate(contours).astype(np.float64) + 0.5
+		points = cv.undistortPoints(points, self.__camera_matrix, self.__dist, R=None, P=None,
+									criteria=(cv.TERM_CRITERIA_COUNT | cv.TERM_CRITERIA_EPS, 20, 1e-10)).reshape(-1, 2)
+
+		# Close each polygon joining its last point to its first one
+		lengths = np.array([polygon.shape[0] for polygon in contours])
+		firsts = np.cumsum(lengths) - lengths
+		next_points = np.arange(points.shape[0]) + 1
+		next_points[firsts + lengths - 1] = firsts
+
+		return points, points[next_points]
+
+
+
+
+	def carve_view(self, rvecs: np.ndarray[int, np.float64], tvecs: np.ndarray[int, np.float64], undist_b_f_image: np.ndarray[int, np.uint8]) -> float:
+		'''
+		PURPOSE: remove from each ray the depth intervals whose projection falls inside the background contours of a frame
+		ARGUMENTS:
+			- rvecs (np.ndarray[int, np.float64]): rotation vector
+			- tvecs (np.ndarray[int, np.float64]): translation vector
+			- undist_b_f_image (np.ndarray[int, np.uint8]): undistorted segmented frame
+		RETURN:
+			- (float): total length of the removed intervals
+		'''
+
+		edges_starts, edges_ends = self.__get_background_edges(undist_b_f_image)
+		active_rays = np.unique(self.__starts // self.__stride).astype(np.int64)
+		if edges_starts.shape[0] == 0 or active_rays.shape[0] == 0: return 0.0
+
+		# Ends of each ray in the camera reference frame, the rays behind the camera are not carved
+		rotation_matrix, _ = cv.Rodrigues(rvecs)
+		rays_low = np.column_stack((self.__rays_xy[active_rays], np.full(active_rays.shape[0], self.__z_low))) @ rotation_matrix.T + np.ravel(tvecs)
+		rays_high = rays_low + rotation_matrix[:, 2] * self.__height
+		in_front = (rays_low[:, 2] > 0) & (rays_high[:, 2] > 0)
+		active_rays, rays_low, rays_high = active_rays[in_front], rays_low[in_front], rays_high[in_front]
+
+		# Each ray projects to the segment p0 + s·d, s in [0, 1]
+		segments_starts = rays_low[:, :2] / rays_low[:, 2:]
+		segments_directions = rays_high[:, :2] / rays_high[:, 2:] - segments_starts
+		edges_directions = edges_ends - edges_starts
+
+		# Intersect the whole line of each ray with the edges, the crossings before the segment give whether it starts on the background
+		crossings_rays, crossings_s = [np.zeros(0, dtype=np.int64)], [np.zeros(0)]
+		chunk_rays = max(1, intersection_chunk_pairs // edges_starts.shape[0])
+		for first_ray in range(0, active_rays.shape[0], chunk_rays):
+			directions = segments_directions[first_ray:first_ray + chunk_rays, np.newaxis, :]
+			offsets = edges_starts[np.newaxis, :, :] - segments_starts[first_ray:first_ray + chunk_rays, np.newaxis, :]
+			denominator = directions[..., 0] * edges_directions[:, 1] - directions[..., 1] * edges_directions[:, 0]
+			with np.errstate(divide='ignore', invalid='ignore'):
+				s = (offsets[..., 0] * edges_directions[:, 1] - offsets[..., 1] * edges_directions[:, 0]) / denominator
+				w = (offsets[..., 0] * directions[..., 1] - offsets[..., 1] * directions[..., 0]) / denominator
+			# Each edge includes only its first point, so that a crossing through a vertex is counted once
+			ray_idx, edge_idx = np.nonzero((denominator != 0) & (w >= 0) & (w < 1) & (s <= 1))
+			crossings_rays.append(first_ray + ray_idx)
+			crossings_s.append(s[ray_idx, edge_idx])
+		crossings_rays, crossings_s = np.concatenate(crossings_rays), np.concatenate(crossings_s)
+
+		before = crossings_s < 0
+		starts_background = np.bincount(crossings_rays[before], minlength=active_rays.shape[0]) % 2 == 1
+		crossings_rays, crossings_s = crossings_rays[~before], crossings_s[~before]
+		ends_background = (starts_background + np.bincount(crossings_rays, minlength=active_rays.shape[0])) % 2 == 1
+
+		# Boundaries of the background runs of each ray, consecutive pairs once sorted along each ray
+		runs_rays = np.concatenate((np.flatnonzero(starts_background), crossings_rays, np.flatnonzero(ends_background)))
+		runs_s = np.concatenate((np.zeros(np.count_nonzero(starts_background)), crossings_s, np.ones(np.count_nonzero(ends_background))))
+		order = np.lexsort((runs_s, runs_rays))
+		runs_rays, runs_s = runs_rays[order][::2], np.reshape(runs_s[order], (-1, 2))
+
+		# The segment is a perspective projection, so the depth along the ray is not linear in s
+		depth_low, depth_high = rays_low[runs_rays, 2:], rays_high[runs_rays, 2:]
+		runs_z = runs_s * depth_low / (runs_s * depth_low + (1 - runs_s) * depth_high) * self.__height
+
+		occupied_length = np.sum(self.__ends - self.__starts)
+		cuts_offsets = active_rays[runs_rays] * self.__stride
+		self.__starts, self.__ends = subtract_intervals(self.__starts, self.__ends, cuts_offsets + runs_z[:, 0], cuts_offsets + runs_z[:, 1])
+
+		return float(occupied_length - np.sum(self.__ends - self.__starts))
+
+
+
+
+	def carve_views(self, views: List[Tuple[np.ndarray[int, np.float64], np.ndarray[int, np.float64], np.ndarray[int, np.uint8]]],
+					frame_indices: List[int] | None = None) -> int:
+		'''
+		PURPOSE: carve the rays with a batch of frames whose pose is already known
+		ARGUMENTS:
+			- views (List[Tuple[np.ndarray[int, np.float64], np.ndarray[int, np.float64], np.ndarray[int, np.uint8]]]): rotation vector,
+				translation vector and undistorted segmented frame of each frame
+			- frame_indices (List[int] | None): index of each frame, not used since the visual hull does not record the carve provenance
+		RETURN:
+			- (int): removed length in sampling steps, comparable with the number of carved voxels of the same size
+		'''
+
+		removed_length = sum(self.carve_view(rvecs, tvecs, undist_b_f_image) for rvecs, tvecs, undist_b_f_image in views)
+
+		return int(round(removed_length / self.__sampling_step))
+
+
+
+
+	def get_cubes_coords_and_faces(self) -> Tuple[np.ndarray[int, np.float32], np.ndarray[int, np.int32]]:
+		'''
+		PURPOSE: get the boxes coordinates and faces of the occupied intervals to write a PLY file
+		ARGUMENTS: None
+		RETURN: Tuple[np.ndarray[int, np.float32], np.ndarray[int, np.int32]]
+			- (np.ndarray[int, np.float32]): boxes vertices coordinates
+			- (np.ndarray[int, np.int32]): boxes faces
+		'''
+
+		rays, z_starts, z_ends = self.get_intervals()
+		lower_xy = self.__rays_xy[rays] - self.__sampling_step / 2
+
+		return get_boxes_coords_and_faces(np.column_stack((lower_xy, z_starts)), np.column_stack((lower_xy + self.__sampling_step, z_ends)))
@@ -1,89 +1,222 @@
 import numpy as np
 import cv2 as cv
 
-from typing import Dict, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+from utils import count_foreground_in_rects, fill_rects_mask, get_boxes_coords_and_faces, get_foreground_integral_image, get_projection_stretch_bound, get_silhouette_distances, \
+	project_camera_points
+from occupancy_grid import OccupancyGrid
+from column_intervals import ColumnIntervals
+from fused_carving import fused_carve_voxels, fused_kernel_available
+from turntable_pose_estimator import TurntablePoseEstimator
+
+# Fraction of carved voxels in the active set after which the set is compacted
+active_voxels_compaction_ratio = 0.25
+
+# Number of active voxels projected and checked together, small enough to stay in cache
+chunk_voxels = 1 << 16
+
+# Maximum number of voxels of the cells carved by the hierarchical carving that are cleared at once
+clear_chunk_voxels = 1 << 20
+
+# Approximate peak memory used to project and check a single point, used to size the tiles of the tiled grid
+tile_bytes_per_point = 256
+
+# Carve provenance value of the voxels never carved
+surviving_voxel_frame = np.iinfo(np.uint16).max
+
 
 # VoxelsCube class that manege projection of markers points into the image
 
 class VoxelsCube:
     
-	def __init__(self, cube_half_edge, voxel_cube_edge_dim, camera_matrix, dist, frame_width, frame_height) -> None:
+	def __init__(self, cube_half_edge, voxel_cube_edge_dim, camera_matrix, dist, frame_width, frame_height, hierarchical = False, footprint = False, fused = False, threads = 1, memory_budget_mb = None,
+			  intervals = False, z_subdivisions = 1, bounding_box = None, provenance = False, pose_only = False) -> None:
 		self.__frame_width = frame_width
 		self.__frame_height = frame_height
 		self.__camera_matrix = camera_matrix
 		self.__dist = dist
 		self.__voxel_cube_edge_dim = voxel_cube_edge_dim
-		self.__cube_half_edge = cube_half_edge
 		self.__centroid_axes = np.float32([[20,0,0], [0,20,0], [0,0,30]]).reshape(-1,3)
+		# The grid fills the cube above the board by default, or a tighter box estimated from the silhouettes
+		estimated_box = bounding_box is not None
+		if bounding_box is None: bounding_box = ([-cube_half_edge, -cube_half_edge, 70], [cube_half_edge, cube_half_edge, 70 + cube_half_edge * 2])
+		lower, upper = np.asarray(bounding_box[0], dtype=np.float64), np.asarray(bounding_box[1], dtype=np.float64)
+		# The default cube keeps only the whole voxels inside it, while an estimated box is rounded up to whole voxels so that its top layer is not cut off
+		voxels = (upper - lower) / voxel_cube_edge_dim
+		voxels = np.ceil(voxels - 1e-9) if estimated_box else np.floor(voxels)
+		if estimated_box: upper = lower + voxels * voxel_cube_edge_dim
 		self.__cube_vertices = np.float32([
-			[-cube_half_edge, -cube_half_edge, 70], [-cube_half_edge, cube_half_edge, 70],
-			[cube_half_edge, cube_half_edge, 70], [cube_half_edge, -cube_half_edge, 70],
-			[-cube_half_edge, -cube_half_edge, 70 + cube_half_edge * 2], [-cube_half_edge, cube_half_edge, 70 + cube_half_edge * 2],
-			[cube_half_edge, cube_half_edge, 70 + cube_half_edge * 2], [cube_half_edge, -cube_half_edge, 70 + cube_half_edge * 2]
+			[lower[0], lower[1], lower[2]], [lower[0], upper[1], lower[2]],
+			[upper[0], upper[1], lower[2]], [upper[0], lower[1], lower[2]],
+			[lower[0], lower[1], upper[2]], [lower[0], upper[1], upper[2]],
+			[upper[0], upper[1], upper[2]], [upper[0], lower[1], upper[2]]
 		])
-		self.__voxels_center, self.__voxs_cubes_verts_coords = self.get_cube_and_centroids_voxels()
-		self.__binary_centroids_fore_back = np.ones((np.power(self.__voxels_center.shape[0], 3), 1), dtype=np.int32)
+		self.__grid_lower = lower
+		self.__grid_upper = upper
+		# Number of voxels along the z, y and x axes, the same order of the flat index
+		self.__grid_shape = tuple(int(axis_voxels) for axis_voxels in voxels[::-1])
+		# The interval grid stores runs of voxels along z, so each voxel edge can be split in thinner slices along z
+		self.__intervals = intervals
+		self.__z_subdivisions = z_subdivisions if intervals else 1
+		# A cube that only estimates the pose and draws the frame, as with the visual hull engine, does not allocate the voxels grid
+		if pose_only:
+			self.__binary_centroids_fore_back = None
+		elif intervals:
+			self.__binary_centroids_fore_back = ColumnIntervals((self.__grid_shape[0] * self.__z_subdivisions, *self.__grid_shape[1:]))
+			if hierarchical or footprint or fused or memory_budget_mb is not None: print('The interval carving tests the voxels centroid on its own, ignoring the other carving options.')
+			hierarchical, footprint, fused, memory_budget_mb = False, False, False, None
+		else:
+			self.__binary_centroids_fore_back = OccupancyGrid(self.__grid_shape)
+		self.__voxels_count = self.__binary_centroids_fore_back.count() if not pose_only else 0
+		# The tiled grid keeps only the occupancy bits, the active voxels are generated tile by tile
+		self.__tiled = memory_budget_mb is not None
+		self.__hierarchical = hierarchical and not self.__tiled
+		# Pyramid of the cells that still contain a foreground voxel, kept across the frames by the hierarchical carving
+		self.__alive_levels = None
+		if hierarchical and self.__tiled: print('The hierarchical carving needs the whole grid in memory, using the tiled carving.')
+		self.__footprint = footprint
+		self.__fused = fused and fused_kernel_available and not self.__hierarchical and not footprint and not provenance
+		if fused and not fused_kernel_available: print('Numba is not installed, using the NumPy carving.')
+		if fused and fused_kernel_available and (self.__hierarchical or footprint): print('The fused kernel tests the voxels centroid on its own, using the NumPy carving with the hierarchical and footprint options.')
+		if fused and provenance: print('The carve provenance needs the carved voxels of each frame, using the NumPy carving.')
+		# Frame that carved each voxel for the first time, used to rebuild the occupancy without some frames
+		if provenance and intervals: print('The interval carving does not record the carve provenance.')
+		self.__carved_at = np.full(self.__voxels_count, surviving_voxel_frame, dtype=np.uint16) if provenance and not intervals and not pose_only else None
+		self.__carved_views = 0
+		# The flat indices of the active voxels take 4 bytes each while they fit, as the sparse occupancy grid
+		self.__active_voxels = None if self.__tiled or intervals or pose_only else np.arange(self.__voxels_count, dtype=np.uint32 if self.__voxels_count <= 2 ** 31 else np.int64)
+		self.__tile_points = int(memory_budget_mb * 2 ** 20) // (tile_bytes_per_point * threads) if self.__tiled else 0
+		self.__carved_active_voxels = 0
+		self.__first_centroid = lower + voxel_cube_edge_dim / 2
+		self.__box_corners_selector = np.array([[x, y, z] for z in (0, 1) for y in (0, 1) for x in (0, 1)], dtype=bool)
+		# Bound of the projected voxels radius, used to settle the voxels far from the silhouette boundary without the footprint test
+		self.__projection_stretch_bound = get_projection_stretch_bound(camera_matrix, dist, (frame_width, frame_height)) if footprint else None
+		self.__threads = threads
+		self.__thread_pool = ThreadPoolExecutor(max_workers=threads) if threads > 1 and not pose_only else None
   
 	
  
 	
-	def get_cube_and_centroids_voxels(self) -> Tuple[np.ndarray[int, np.float32], np.ndarray[int, np.float32]]:
+	def get_voxels_cubes_verts_coords(self, voxels_idx: np.ndarray[int, np.int64]) -> np.ndarray[int, np.float32]:
+		'''
+		PURPOSE: obtain on demand the corners coordinates that form the given voxels cubes from their flat index and the edge size,
+			neither the voxels centroid nor their corners are stored
+		ARGUMENTS:
+			- voxels_idx (np.ndarray[int, np.int64]): flat index of the voxels
+		RETURN:
+			- (np.ndarray[int, np.float32]) (M, 8, 3) voxels cube coordinates
+		'''	
+
+		half_voxel = self.__voxel_cube_edge_dim / 2
+
+		# Voxels centre coordinates from their [z, y, x] grid index
+		zz, yy, xx = np.unravel_index(voxels_idx, self.__grid_shape)
+		centres = self.__first_centroid + np.stack((xx, yy, zz), axis=-1) * self.__voxel_cube_edge_dim
+
+		# Offsets of the 8 voxel cube vertices in the order used by the PLY faces
+		corners_offsets = np.array([
+			[1, 1, 1], [1, 1, -1], [1, -1, 1], [1, -1, -1],
+			[-1, 1, 1], [-1, 1, -1], [-1, -1, 1], [-1, -1, -1]
+		]) * half_voxel
+
+		return (centres[:, np.newaxis, :] + corners_offsets).astype(np.float32)
+
+
+
+
+	def get_occupancy(self) -> OccupancyGrid | ColumnIntervals:
 		'''
-		PURPOSE: obtain the centre voxels centroid coordinates and their respective corners coordinates that form the voxel cube
+		PURPOSE: get the occupancy grid of the voxels
 		ARGUMENTS: None
-		RETURN: Tuple[np.ndarray[int, np.float32], np.ndarray[int, np.float32]]
-			- voxels_center (np.ndarray[int, np.float32]): voxels centroids
-			- centroids_cubes_coords (np.ndarray[int, np.float32]) voxels cube coordinates
+		RETURN:
+			- (OccupancyGrid | ColumnIntervals): occupancy grid, or column intervals with the interval carving
 		'''	
 
-		# Get the number of voxels in a single dimension 
-		first_dim_voxel = (self.__cube_half_edge * 2) // self.__voxel_cube_edge_dim
-		
-		# Initialize the np.array to store the voxels centre coords and voxels cube vertices coords
-		voxels_center = np.zeros((0, first_dim_voxel, first_dim_voxel, 3), dtype=np.float32)
-		centroids_cubes_coords = np.zeros((0, first_dim_voxel, first_dim_voxel, 8, 3), dtype=np.float32)
-	
-		# Iterate through the z axis
-		for z in np.arange(70 + (self.__voxel_cube_edge_dim / 2), 70 + (self.__cube_half_edge * 2) - self.__voxel_cube_edge_dim / 2 + 1, 
-					 		self.__voxel_cube_edge_dim):
-			
-			voxels_center_at_z = np.zeros((0, first_dim_voxel, 3), dtype=np.float32)
-			centroids_cubes_coords_at_z = np.zeros((0, first_dim_voxel, 8, 3), dtype=np.float32)
-			
-			# Iterate through the y axis
-			for y in np.arange(-self.__cube_half_edge + self.__voxel_cube_edge_dim / 2, 
-					  			self.__cube_half_edge - self.__voxel_cube_edge_dim / 2 + 1, self.__voxel_cube_edge_dim):
-				
-				rows = np.zeros((0,3), dtype=np.float32)
-				cubes = np.zeros((0,8,3), dtype=np.float32)
-				
-				# Iterate through the x axis
-				for x in np.arange(-self.__cube_half_edge + self.__voxel_cube_edge_dim / 2, 
-									self.__cube_half_edge - self.__voxel_cube_edge_dim / 2 + 1, self.__voxel_cube_edge_dim):
-					
-					rows = np.vstack((rows, np.array([x, y, z], dtype=np.float32))) # Voxel centre coords
-					cube = np.array([	# Voxel cube vertices coords
-						np.array([y + self.__voxel_cube_edge_dim / 2, x + self.__voxel_cube_edge_dim / 2, z + self.__voxel_cube_edge_dim / 2]),
-						np.array([y + self.__voxel_cube_edge_dim / 2, x + self.__voxel_cube_edge_dim / 2, z - self.__voxel_cube_edge_dim / 2]),
-						np.array([y + self.__voxel_cube_edge_dim / 2, x - self.__voxel_cube_edge_dim / 2, z + self.__voxel_cube_edge_dim / 2]),
-						np.array([y + self.__voxel_cube_edge_dim / 2, x - self.__voxel_cube_edge_dim / 2, z - self.__voxel_cube_edge_dim / 2]),
-						np.array([y - self.__voxel_cube_edge_dim / 2, x + self.__voxel_cube_edge_dim / 2, z + self.__voxel_cube_edge_dim / 2]),
-						np.array([y - self.__voxel_cube_edge_dim / 2, x + self.__voxel_cube_edge_dim / 2, z - self.__voxel_cube_edge_dim / 2]),
-						np.array([y - self.__voxel_cube_edge_dim / 2, x - self.__voxel_cube_edge_dim / 2, z + self.__voxel_cube_edge_dim / 2]),
-						np.array([y - self.__voxel_cube_edge_dim / 2, x - self.__voxel_cube_edge_dim / 2, z - self.__voxel_cube_edge_dim / 2]),
-					], dtype=np.float32)
-					cubes = np.vstack((cubes, np.expand_dims(cube, axis=0)))
-				
-				voxels_center_at_z = np.vstack((voxels_center_at_z, np.expand_dims(rows, axis=0)))
-				centroids_cubes_coords_at_z = np.vstack((centroids_cubes_coords_at_z, np.expand_dims(cubes, axis=0)))
-	
-			voxels_center = np.vstack((voxels_center, np.expand_dims(voxels_center_at_z, axis=0)))
-			centroids_cubes_coords = np.vstack((centroids_cubes_coords, np.expand_dims(centroids_cubes_coords_at_z, axis=0)))
+		return self.__binary_centroids_fore_back
+
+
+
+
+	def get_grid_bounds(self) -> Tuple[np.ndarray[int, np.float64], np.ndarray[int, np.float64]]:
+		'''
+		PURPOSE: get the box covered by the voxels grid
+		ARGUMENTS: None
+		RETURN: Tuple[np.ndarray[int, np.float64], np.ndarray[int, np.float64]]
+			- (np.ndarray[int, np.float64]): lower x, y, z coordinates of the grid
+			- (np.ndarray[int, np.float64]): upper x, y, z coordinates of the grid
+		'''	
+
+		return self.__grid_lower, self.__grid_upper
+
+
+
+
+	def get_carved_at(self) -> np.ndarray[int, np.uint16] | None:
+		'''
+		PURPOSE: get the carve provenance of the voxels
+		ARGUMENTS: None
+		RETURN:
+			- (np.ndarray[int, np.uint16] | None): frame index that carved each voxel, surviving_voxel_frame for the foreground voxels,
+				None if the provenance is not recorded
+		'''	
+
+		return self.__carved_at
+
+
+
+
+	def intersect_occupancy(self, occupancy: OccupancyGrid | ColumnIntervals, carved_at: np.ndarray[int, np.uint16] | None = None) -> None:
+		'''
+		PURPOSE: intersect the voxels with an occupancy grid carved elsewhere, for instance by another process
+		ARGUMENTS:
+			- occupancy (OccupancyGrid | ColumnIntervals): occupancy grid with the same shape
+			- carved_at (np.ndarray[int, np.uint16] | None): carve provenance of the other grid, each voxel keeps the earliest frame that carved it
+		RETURN: None
+		'''	
+
+		self.__binary_centroids_fore_back.intersect(occupancy)
+		self.__alive_levels = None
+		if self.__carved_at is not None and carved_at is not None: self.__carved_at = np.minimum(self.__carved_at, carved_at)
+		if self.__intervals: return
+		self.__binary_centroids_fore_back.update_storage()
+		if not self.__tiled: self.__active_voxels = self.__active_voxels[self.__binary_centroids_fore_back.test(self.__active_voxels)]
+		self.__carved_active_voxels = 0
+
+
+
+
+	def set_carved_at(self, carved_at: np.ndarray[int, np.uint16]) -> None:
+		'''
+		PURPOSE: restore the carve provenance saved by a previous carving, and the occupancy where the voxels carved by a frame are background
+		ARGUMENTS:
+			- carved_at (np.ndarray[int, np.uint16]): frame index that carved each voxel, surviving_voxel_frame for the foreground voxels
+		RETURN: None
+		'''	
+
+		if self.__carved_at is None: raise ValueError('The carve provenance is not recorded')
+		if carved_at.shape != self.__carved_at.shape: raise ValueError('The carve provenance has a different number of voxels')
+
+		occupancy = OccupancyGrid(self.__grid_shape)
+		occupancy.clear_where(np.reshape(carved_at != surviving_voxel_frame, self.__grid_shape))
+		self.intersect_occupancy(occupancy, carved_at)
+
+
+
+
+	def close(self) -> None:
+		'''
+		PURPOSE: stop the worker threads of the thread pool, once the object or the resolution is finished
+		ARGUMENTS: None
+		RETURN: None
+		'''	
+
+		if self.__thread_pool is not None: self.__thread_pool.shutdown()
+		self.__thread_pool = None
+
+
 
-		return voxels_center, centroids_cubes_coords
-	
-	
- 
 
 	def get_newCameraMatrix(self) -> None:
 		'''
@@ -118,29 +251,59 @@ class VoxelsCube:
 
 
 
-	def apply_projections(self, twoD_points: np.ndarray[int, np.float32], threeD_points: np.ndarray[int, np.float32]) \
-			-> Tuple[cv.typing.MatLike, cv.typing.MatLike]:
+	def set_pose(self, rvecs: np.ndarray[int, np.float64], tvecs: np.ndarray[int, np.float64]) -> None:
+		'''
+		PURPOSE: set the camera pose used by the projections and the affine terms of the voxels grid
+		ARGUMENTS: 
+			- rvecs (np.ndarray[int, np.float64]): rotation vector
+			- tvecs (np.ndarray[int, np.float64]): translation vector
+		RETURN: None
+		'''	
+
+		self.__rvecs = rvecs
+		self.__tvecs = tvecs
+
+		# The grid is regular, so in the camera reference frame the voxel [k, j, i] is at base + i·a + j·b + k·c
+		rotation_matrix, _ = cv.Rodrigues(self.__rvecs)
+		self.__grid_base = rotation_matrix @ self.__first_centroid + np.ravel(self.__tvecs)
+		self.__grid_axes = (rotation_matrix * self.__voxel_cube_edge_dim).T
+
+
+
+
+	def get_pose(self) -> Tuple[np.ndarray[int, np.float64], np.ndarray[int, np.float64]]:
+		'''
+		PURPOSE: get the camera pose of the last frame
+		ARGUMENTS: None
+		RETURN: Tuple[np.ndarray[int, np.float64], np.ndarray[int, np.float64]]
+			- rvecs (np.ndarray[int, np.float64]): rotation vector
+			- tvecs (np.ndarray[int, np.float64]): translation vector
+		'''	
+
+		return self.__rvecs, self.__tvecs
+
+
+
+
+	def apply_projections(self, twoD_points: np.ndarray[int, np.float32], threeD_points: np.ndarray[int, np.float32],
+					   pose_estimator: TurntablePoseEstimator | None = None) -> Tuple[cv.typing.MatLike, cv.typing.MatLike]:
 		'''
 		PURPOSE: apply the projections of voxels centroid, cube and board centroid
 		ARGUMENTS: 
 			- twoD_points (np.ndarray[int, np.float32])
 			- threeD_points (np.ndarray[int, np.float32])
+			- pose_estimator (TurntablePoseEstimator | None): turntable constrained pose estimator, None to solve a full PnP for each frame
 		RETURN: Tuple[cv.typing.MatLike, cv.typing.MatLike]
 			- imgpts_centroid (cv.typing.MatLike): 2D image centroid coordinates
 			- imgpts_cube (cv.typing.MatLike): 2D image cube coordinates
 		'''	
 
 		# Find the rotation and translation vectors
-		_, rvecs, tvecs = cv.solvePnP(objectPoints=threeD_points.astype('float32'), imagePoints=twoD_points.astype('float32'),
-								cameraMatrix=self.__camera_matrix, distCoeffs=self.__dist, flags=cv.SOLVEPNP_IPPE)
-		self.__rvecs = rvecs
-		self.__tvecs = tvecs
-
-		# Obtain the projection of the vocels cubes centroid
-		imgpts_voxels_cubes_centroid, _ = cv.projectPoints(objectPoints=np.reshape(self.__voxels_center, (np.power(self.__voxels_center.shape[0], 3), 3)),
-                                            				rvec=self.__rvecs, tvec=self.__tvecs, cameraMatrix=self.__camera_matrix, distCoeffs=self.__dist)
-		
-		self.__imgpts_voxels_cubes_centroid = np.squeeze(imgpts_voxels_cubes_centroid)
+		if pose_estimator is not None: rvecs, tvecs = pose_estimator.estimate_pose(twoD_points, threeD_points)
+		else: _, rvecs, tvecs = cv.solvePnP(objectPoints=threeD_points.astype('float32'), imagePoints=twoD_points.astype('float32'),
+										   cameraMatrix=self.__camera_matrix, distCoeffs=self.__dist, flags=cv.SOLVEPNP_IPPE)
+		# The vocels cubes are projected chunk by chunk while carving them in set_background_voxels
+		self.set_pose(rvecs, tvecs)
 
 	 	# Obtain the projection of the board centroid with axes and the cube that will inglobe the object
 		imgpts_centroid, _ = cv.projectPoints(objectPoints=self.__centroid_axes, rvec=self.__rvecs, tvec=self.__tvecs, cameraMatrix=self.__camera_matrix, distCoeffs=self.__dist)
@@ -151,6 +314,26 @@ class VoxelsCube:
 
 
 
+	def __get_voxels_camera_coords(self, voxels_idx: np.ndarray[int, np.int64]) -> np.ndarray[int, np.float64]:
+		'''
+		PURPOSE: obtain the voxels centroid in the camera reference frame from their flat index, expanding the per axis affine terms of the grid
+		ARGUMENTS: 
+			- voxels_idx (np.ndarray[int, np.int64]): flat voxels indices
+		RETURN:
+			- (np.ndarray[int, np.float64]): (M, 3) voxels centroid in the camera reference frame
+		'''	
+
+		z_voxels, y_voxels, x_voxels = self.__grid_shape
+
+		# Terms i·a, j·b and k·c for every index along the three axes, O(N) to compute
+		axes_terms = np.arange(max(self.__grid_shape))[np.newaxis, :, np.newaxis] * self.__grid_axes[:, np.newaxis, :]
+
+		return self.__grid_base + axes_terms[0][voxels_idx % x_voxels] + axes_terms[1][(voxels_idx // x_voxels) % y_voxels] + \
+			axes_terms[2][voxels_idx // (x_voxels * y_voxels)]
+
+
+
+
 	def compute_RMSE(self, IDs_points: np.ndarray[int, np.float32], marker_reference: Dict[int, Tuple[int, int, int]], twoD_points: np.ndarray[int, np.float32]) -> np.float32:
 		'''
 		PURPOSE: compute the RMSE of the reporojection points
@@ -176,63 +359,783 @@ class VoxelsCube:
 
 
 
-	def set_background_voxels(self, undistorted_resolution: Tuple[int, int], undist_b_f_image: np.ndarray[int, np.uint8], undist: np.ndarray[int, np.uint8]) -> np.ndarray[int, np.uint8]:
+	def set_background_voxels(self, undistorted_resolution: Tuple[int, int], undist_b_f_image: np.ndarray[int, np.uint8], undist: np.ndarray[int, np.uint8],
+							  frame_index: int | None = None) -> np.ndarray[int, np.uint8]:
 		'''
 		PURPOSE: update the binary array of voxels centroid by analysing their position on the segmented image
 		ARGUMENTS: 
 			- undistorted_resolution (Tuple[int, int]): undistorted image resolution
 			- undist_b_f_image (np.ndarray[int, np.uint8]): undistorted segmented frame
 			- undist (np.ndarray[int, np.uint8]): undistorted image to edit
+			- frame_index (int | None): index of the frame recorded by the carve provenance, None for the number of frames carved before
 		RETURN:
 			- undist (np.ndarray[int, np.uint8]): undistorted edited image
 		'''	
 
-		for idx, centr_coords in enumerate(self.__imgpts_voxels_cubes_centroid):
-			if centr_coords[0] < undistorted_resolution[0] and centr_coords[1] < undistorted_resolution[1] and \
-					centr_coords[0] >= 0  and centr_coords[1] >= 0 and undist_b_f_image[int(centr_coords[1]), int(centr_coords[0])] == 0:
-				self.__binary_centroids_fore_back[idx] = 0
-				cv.circle(undist, (int(centr_coords[0]), int(centr_coords[1])), 1, (255,255,255), -1)
+		frame_index = self.__carved_views if frame_index is None else frame_index
+		self.__carved_views += 1
+
+		if self.__intervals:
+			carved_pixels = np.zeros(undist.shape[:2], dtype=bool)
+			self.__carve_intervals(undist_b_f_image, carved_pixels)
+		elif self.__hierarchical:
+			carved_pixels = self.__set_background_cells(undistorted_resolution, undist_b_f_image, frame_index)
+		elif self.__fused and not self.__binary_centroids_fore_back.is_sparse():
+			# Project, check and carve each chunk of active voxels in a single pass of the compiled kernel
+			carved_pixels = np.zeros(undist.shape[:2], dtype=np.uint8)
+			self.__fused_carve_view(undist_b_f_image, carved_pixels)
+		else:
+			# Project and check each chunk of active voxels
+			carved_pixels = np.zeros(undist.shape[:2], dtype=bool)
+			# The voxels settled outside the silhouette are not used here, so only the foreground distances are computed
+			silhouette_tables = (get_foreground_integral_image(undist_b_f_image), *get_silhouette_distances(undist_b_f_image, background=False)) if self.__footprint else None
+			carved_rects, pending_rects = [np.zeros((0, 4), dtype=np.int32)], 0
+			for carved_voxels, rects in self.__map_active_chunks(lambda voxels_idx: self.__carve_chunk(voxels_idx, undistorted_resolution, undist_b_f_image,
+																											silhouette_tables, carved_pixels),
+															   chunk_voxels, 8 if self.__footprint else 1):
+				self.__record_carved_voxels(carved_voxels, frame_index)
+				self.__carved_active_voxels += self.__binary_centroids_fore_back.clear(carved_voxels)
+				carved_rects.append(rects)
+				pending_rects += rects.shape[0]
+
+				# Pixels covered by the carved voxels footprints, the tiled grid draws them before they exceed a chunk
+				if self.__tiled and pending_rects >= chunk_voxels:
+					carved_pixels |= fill_rects_mask(carved_pixels.shape, *np.concatenate(carved_rects).T)
+					carved_rects, pending_rects = [np.zeros((0, 4), dtype=np.int32)], 0
+
+			if pending_rects > 0: carved_pixels |= fill_rects_mask(carved_pixels.shape, *np.concatenate(carved_rects).T)
+
+		self.__compact_active_voxels()
+
+		# Draw the carved voxels in a single step by dilating their pixels with the same shape of a filled circle of radius 1
+		carved_pixels = cv.dilate(np.uint8(carved_pixels), cv.getStructuringElement(cv.MORPH_ELLIPSE, (3,3)))
+		undist[carved_pixels > 0] = (255,255,255)
 
 		return undist
 
 
 
 
-	def get_cubes_coords_and_faces(self) -> Tuple[np.ndarray[int, np.float32], np.ndarray[int, np.float32]]:
+	def __map_active_chunks(self, function: Callable[[np.ndarray[int, np.int64]], Any], max_chunk_voxels: int, points_per_voxel: int) -> Iterable[Any]:
+		'''
+		PURPOSE: split the active voxels in chunks and apply a function to each of them, on the thread pool if available
+		ARGUMENTS: 
+			- function (Callable[[np.ndarray[int, np.int64]], Any]): function applied to the flat index of the voxels of each chunk
+			- max_chunk_voxels (int): maximum number of voxels in a chunk
+			- points_per_voxel (int): number of points projected for each voxel, used to fit the tiles in the memory budget
+		RETURN:
+			- (Iterable[Any]): result of each chunk, in order
+		'''	
+
+		if self.__tiled:
+			# Each tile is a range of flat indices whose active voxels are read from the occupancy bits only when it is carved,
+			# the tiles are aligned to the occupancy bytes and sized to fit the memory budget
+			tile_voxels = max(8, min(max_chunk_voxels, self.__tile_points // points_per_voxel) // 8 * 8)
+			tiles = range(0, self.__voxels_count, tile_voxels)
+			carve_tile = lambda start: function(self.__binary_centroids_fore_back.get_set_in_range(start, min(start + tile_voxels, self.__voxels_count)))
+
+			# The results are consumed lazily, with the thread pool one tile per thread is carved at a time
+			if self.__thread_pool is None: return map(carve_tile, tiles)
+			return (result for wave in range(0, len(tiles), self.__threads) for result in self.__thread_pool.map(carve_tile, tiles[wave:wave + self.__threads]))
+
+		# Move each split point to the next occupancy byte, so that two chunks never update the same byte of packed bits
+		splits = np.arange(max_chunk_voxels, self.__active_voxels.shape[0], max_chunk_voxels)
+		splits = np.unique(np.searchsorted(self.__active_voxels, ((self.__active_voxels[splits] >> 3) + 1) << 3))
+		chunks = [chunk for chunk in np.split(self.__active_voxels, splits) if chunk.shape[0] > 0]
+
+		if self.__thread_pool is None: return [function(chunk) for chunk in chunks]
+		return list(self.__thread_pool.map(function, chunks))
+
+
+
+
+	def __carve_chunk(self, voxels_idx: np.ndarray[int, np.int64], undistorted_resolution: Tuple[int, int], undist_b_f_image: np.ndarray[int, np.uint8],
+					  silhouette_tables: Tuple[np.ndarray[int, np.int32], np.ndarray[int, np.float32], np.ndarray[int, np.float32]] | None,
+					  carved_pixels: np.ndarray[int, np.bool_]) -> Tuple[np.ndarray[int, np.int64], np.ndarray[int, np.int32]]:
+		'''
+		PURPOSE: project a chunk of voxels and find the ones to carve, by their centroid or by their footprint
+		ARGUMENTS: 
+			- voxels_idx (np.ndarray[int, np.int64]): flat index of the voxels of the chunk
+			- undistorted_resolution (Tuple[int, int]): undistorted image resolution
+			- undist_b_f_image (np.ndarray[int, np.uint8]): undistorted segmented frame
+			- silhouette_tables (Tuple[np.ndarray[int, np.int32], np.ndarray[int, np.float32], np.ndarray[int, np.float32]] | None): integral image
+				of the foreground and distances from the silhouette boundary, used by the footprint carving
+			- carved_pixels (np.ndarray[int, np.bool_]): pixels of the carved centroids, updated in place
+		RETURN: Tuple[np.ndarray[int, np.int64], np.ndarray[int, np.int32]]
+			- (np.ndarray[int, np.int64]): flat index of the voxels to carve
+			- (np.ndarray[int, np.int32]): footprint rectangles of the voxels to carve
+		'''	
+
+		camera_coords = self.__get_voxels_camera_coords(voxels_idx)
+		imgpts_centroid = project_camera_points(camera_coords, self.__camera_matrix, self.__dist)
+
+		if self.__footprint:
+			# The voxels settled inside the silhouette pass the test without projecting their corners, the ones settled outside
+			# are carved only once and still need their footprint to be drawn
+			settled_foreground, _ = self.__get_settled_voxels(camera_coords, imgpts_centroid, undistorted_resolution, silhouette_tables[1:])
+			voxels_idx, camera_coords = voxels_idx[~settled_foreground], camera_coords[~settled_foreground]
+
+			# Carve the voxels whose footprint does not contain any foreground pixel
+			corners_offsets = np.where(self.__box_corners_selector, 0.5, -0.5) @ self.__grid_axes
+			imgpts_corners = project_camera_points(camera_coords[:, np.newaxis, :] + corners_offsets, self.__camera_matrix, self.__dist)
+			rects, all_background, _ = self.__get_footprints(imgpts_corners, undistorted_resolution, silhouette_tables[0])
+			return voxels_idx[all_background], rects[all_background]
+
+		# Otherwise carve the voxels whose centroid falls on the background
+		inside_idx, pixels, background = self.__get_background_centroids(imgpts_centroid, undistorted_resolution, undist_b_f_image)
+		carved_pixels[pixels[background, 1], pixels[background, 0]] = True
+
+		return voxels_idx[inside_idx[background]], np.zeros((0, 4), dtype=np.int32)
+
+
+
+
+	def __record_carved_voxels(self, voxels_idx: np.ndarray[int, np.int64], frame_index: int | np.ndarray[int, np.int64]) -> None:
+		'''
+		PURPOSE: record the frame that carved a group of voxels, before they are cleared from the occupancy grid
+		ARGUMENTS: 
+			- voxels_idx (np.ndarray[int, np.int64]): flat index of the carved voxels
+			- frame_index (int | np.ndarray[int, np.int64]): index of the frame that carved all the voxels, or of each voxel
+		RETURN: None
+		'''	
+
+		if self.__carved_at is None: return
+
+		# The voxels still in the active set may be carved again, they keep the first frame that carved them
+		first_time = self.__carved_at[voxels_idx] == surviving_voxel_frame
+		frame_index = np.minimum(np.broadcast_to(frame_index, voxels_idx.shape), surviving_voxel_frame - 1)
+		self.__carved_at[voxels_idx[first_time]] = frame_index[first_time]
+
+
+
+
+	def __compact_active_voxels(self) -> None:
+		'''
+		PURPOSE: compact the active voxels once enough of them have been carved, so that they are no longer projected,
+			and switch the occupancy grid to the sparse storage once few voxels are left
+		ARGUMENTS: None
+		RETURN: None
+		'''	
+
+		if self.__intervals: return
+
+		self.__binary_centroids_fore_back.update_storage()
+
+		if not self.__tiled and self.__carved_active_voxels > self.__active_voxels.shape[0] * active_voxels_compaction_ratio:
+			self.__active_voxels = self.__active_voxels[self.__binary_centroids_fore_back.test(self.__active_voxels)]
+			self.__carved_active_voxels = 0
+
+
+
+
+	def __fused_carve_view(self, undist_b_f_image: np.ndarray[int, np.uint8], carved_pixels: np.ndarray[int, np.uint8]) -> int:
+		'''
+		PURPOSE: carve all the active voxels with the actual pose, chunk by chunk with the compiled kernel
+		ARGUMENTS: 
+			- undist_b_f_image (np.ndarray[int, np.uint8]): undistorted segmented frame
+			- carved_pixels (np.ndarray[int, np.uint8]): pixels of the carved voxels, updated in place
+		RETURN:
+			- carved (int): number of voxels carved
+		'''	
+
+		carved = sum(self.__map_active_chunks(lambda voxels_idx: self.__fused_carve(voxels_idx, undist_b_f_image, carved_pixels), chunk_voxels, 1))
+		self.__binary_centroids_fore_back.decrease_count(carved)
+		self.__carved_active_voxels += carved
+
+		return carved
+
+
+
+
+	def __fused_carve(self, voxels_idx: np.ndarray[int, np.int64], undist_b_f_image: np.ndarray[int, np.uint8], carved_pixels: np.ndarray[int, np.uint8]) -> int:
+		'''
+		PURPOSE: carve a chunk of voxels with the compiled kernel that updates in place the occupancy bits
+		ARGUMENTS: 
+			- voxels_idx (np.ndarray[int, np.int64]): flat index of the voxels of the chunk
+			- undist_b_f_image (np.ndarray[int, np.uint8]): undistorted segmented frame
+			- carved_pixels (np.ndarray[int, np.uint8]): pixels of the carved voxels, updated in place
+		RETURN:
+			- carved (int): number of voxels carved
+		'''	
+
+		return fused_carve_voxels(voxels_idx, self.__grid_shape[2], self.__grid_shape[1], self.__grid_base, self.__grid_axes,
+									np.float64(self.__camera_matrix), np.pad(np.ravel(self.__dist).astype(np.float64), (0, 12))[:12],
+									np.ascontiguousarray(undist_b_f_image), self.__binary_centroids_fore_back.get_bits(), carved_pixels)
+
+
+
+
+	def __carve_intervals(self, undist_b_f_image: np.ndarray[int, np.uint8], carved_pixels: np.ndarray[int, np.bool_]) -> int:
+		'''
+		PURPOSE: carve the column intervals with the actual pose, the grid z step is shortened by the z subdivisions
+		ARGUMENTS: 
+			- undist_b_f_image (np.ndarray[int, np.uint8]): undistorted segmented frame
+			- carved_pixels (np.ndarray[int, np.bool_]): pixels of the background samples, updated in place
+		RETURN:
+			- (int): number of voxels carved
+		'''	
+
+		# The first slice centroid is lower than the voxel centroid by half a voxel minus half a slice
+		slice_axis = self.__grid_axes[2] / self.__z_subdivisions
+		slices_base = self.__grid_base - (self.__grid_axes[2] - slice_axis) / 2
+
+		return self.__binary_centroids_fore_back.carve_silhouette(slices_base, np.vstack((self.__grid_axes[:2], slice_axis)), self.__camera_matrix,
+																	self.__dist, undist_b_f_image, carved_pixels)
+
+
+
+
+	def carve_views(self, views: List[Tuple[np.ndarray[int, np.float64], np.ndarray[int, np.float64], np.ndarray[int, np.uint8]]],
+					frame_indices: List[int] | None = None) -> int:
+		'''
+		PURPOSE: carve the voxels with a batch of frames whose pose is already known, testing each chunk of active voxels with all the frames in turn
+		ARGUMENTS: 
+			- views (List[Tuple[np.ndarray[int, np.float64], np.ndarray[int, np.float64], np.ndarray[int, np.uint8]]]): rotation vector,
+				translation vector and undistorted segmented frame of each frame
+			- frame_indices (List[int] | None): index of each frame recorded by the carve provenance, None for the number of frames carved before
+		RETURN:
+			- (int): number of voxels carved by the batch
+		'''	
+
+		foreground_voxels = self.__binary_centroids_fore_back.count()
+		frame_indices = np.arange(self.__carved_views, self.__carved_views + len(views)) if frame_indices is None else np.asarray(frame_indices)
+		self.__carved_views += len(views)
+
+		# The interval carving samples each column segment at the pixel step of the frame, so the frames are carved one by one
+		if self.__intervals:
+			for rvecs, tvecs, undist_b_f_image in views:
+				self.set_pose(rvecs, tvecs)
+				self.__carve_intervals(undist_b_f_image, np.zeros(undist_b_f_image.shape[:2], dtype=bool))
+			return foreground_voxels - self.__binary_centroids_fore_back.count()
+
+		# The hierarchical carving decides different cells in each frame, so the frames are carved one by one
+		if self.__hierarchical:
+			for (rvecs, tvecs, undist_b_f_image), frame_index in zip(views, frame_indices):
+				self.set_pose(rvecs, tvecs)
+				self.__set_background_cells((undist_b_f_image.shape[1], undist_b_f_image.shape[0]), undist_b_f_image, frame_index)
+			self.__compact_active_voxels()
+			return foreground_voxels - self.__binary_centroids_fore_back.count()
+
+		# The fused kernel carves a single pose in place, so the frames are carved one by one until the grid gets sparse
+		if self.__fused:
+			carved_pixels = np.zeros(views[0][2].shape[:2], dtype=np.uint8) if len(views) > 0 else None
+			while len(views) > 0 and not self.__binary_centroids_fore_back.is_sparse():
+				rvecs, tvecs, undist_b_f_image = views[0]
+				self.set_pose(rvecs, tvecs)
+				self.__fused_carve_view(undist_b_f_image, carved_pixels)
+				self.__compact_active_voxels()
+				views, frame_indices = views[1:], frame_indices[1:]
+			if len(views) == 0: return foreground_voxels - self.__binary_centroids_fore_back.count()
+
+		views_terms = self.__get_views_terms(views)
+
+		# Project and check each chunk of active voxels with all the frames, the chunk size does not depend on the frames since they are tested in turn
+		for carved_voxels, carving_views in self.__map_active_chunks(lambda voxels_idx: self.__carve_views_chunk(voxels_idx, views, *views_terms),
+																	 chunk_voxels, 8 if self.__footprint else 1):
+			self.__record_carved_voxels(carved_voxels, frame_indices[carving_views])
+			self.__carved_active_voxels += self.__binary_centroids_fore_back.clear(carved_voxels)
+
+		self.__compact_active_voxels()
+
+		return foreground_voxels - self.__binary_centroids_fore_back.count()
+
+
+
+
+	def __get_views_terms(self, views: List[Tuple[np.ndarray[int, np.float64], np.ndarray[int, np.float64], np.ndarray[int, np.uint8]]]) \
+			-> Tuple[np.ndarray[int, np.float64], List[Tuple[np.ndarray[int, np.int32], np.ndarray[int, np.float32], np.ndarray[int, np.float32]]] | None,
+					 np.ndarray[int, np.float64] | None]:
+		'''
+		PURPOSE: compute the terms shared by all the chunks of voxels carved with a batch of frames
+		ARGUMENTS: 
+			- views (List[Tuple[np.ndarray[int, np.float64], np.ndarray[int, np.float64], np.ndarray[int, np.uint8]]]): rotation vector,
+				translation vector and undistorted segmented frame of each frame
+		RETURN: Tuple[np.ndarray[int, np.float64], List[Tuple[np.ndarray[int, np.int32], np.ndarray[int, np.float32], np.ndarray[int, np.float32]]] | None,
+				np.ndarray[int, np.float64] | None]
+			- affine_terms (np.ndarray[int, np.float64]): (K, 4, 3) affine terms [base; a; b; c] of the grid in each frame
+			- silhouette_tables (List[Tuple[np.ndarray[int, np.int32], np.ndarray[int, np.float32], np.ndarray[int, np.float32]]] | None): integral image
+				of the foreground and distances from the silhouette boundary of each frame, used by the footprint carving
+			- corners_offsets (np.ndarray[int, np.float64] | None): (K, 8, 3) voxel corners offsets in each frame, used by the footprint carving
+		'''	
+
+		# Stack the affine terms [base; a; b; c] of the grid for all the frames
+		affine_terms = []
+		for rvecs, tvecs, _ in views:
+			self.set_pose(rvecs, tvecs)
+			affine_terms.append(np.vstack((self.__grid_base, self.__grid_axes)))
+		affine_terms = np.stack(affine_terms)
+
+		if not self.__footprint: return affine_terms, None, None
+
+		silhouette_tables = [(get_foreground_integral_image(undist_b_f_image), *get_silhouette_distances(undist_b_f_image)) for _, _, undist_b_f_image in views]
+		corners_offsets = np.where(self.__box_corners_selector, 0.5, -0.5) @ affine_terms[:, 1:, :]
+
+		return affine_terms, silhouette_tables, corners_offsets
+
+
+
+
+	def rebuild_occupancy(self, views: Iterable[Tuple[int, np.ndarray[int, np.float64], np.ndarray[int, np.float64], np.ndarray[int, np.uint8]]],
+						  ignored_frames: Iterable[int]) -> int:
+		'''
+		PURPOSE: rebuild the occupancy as if some frames were never carved, re-testing only the voxels carved by them with the following frames
+		ARGUMENTS: 
+			- views (Iterable[Tuple[int, np.ndarray[int, np.float64], np.ndarray[int, np.float64], np.ndarray[int, np.uint8]]]): frame index, rotation vector,
+				translation vector and undistorted segmented frame of the carved frames, in increasing frame order as in the views cache
+			- ignored_frames (Iterable[int]): indices of the frames to ignore
+		RETURN:
+			- (int): number of voxels restored as foreground
+		'''	
+
+		if self.__carved_at is None: raise ValueError('The carve provenance is not recorded')
+
+		ignored_frames = set(ignored_frames)
+		pending_voxels = np.flatnonzero(np.isin(self.__carved_at, list(ignored_frames)))
+		pending_frames = self.__carved_at[pending_voxels]
+		self.__carved_at[pending_voxels] = surviving_voxel_frame
+
+		# Frames before the ignored one did not carve the voxel, so it is carved by the first following frame that carves it, if any
+		for frame_index, rvecs, tvecs, undist_b_f_image in views:
+			if pending_voxels.shape[0] == 0: break
+			if frame_index in ignored_frames: continue
+			following = np.flatnonzero(pending_frames < frame_index)
+			if following.shape[0] == 0: continue
+
+			view = [(rvecs, tvecs, undist_b_f_image)]
+			views_terms = self.__get_views_terms(view)
+			carved_voxels = np.concatenate([np.zeros(0, dtype=np.int64)] + [self.__carve_views_chunk(pending_voxels[following[start:start + chunk_voxels]], view, *views_terms)[0]
+																			 for start in range(0, following.shape[0], chunk_voxels)])
+			self.__record_carved_voxels(carved_voxels, frame_index)
+			still_pending = ~np.isin(pending_voxels, carved_voxels)
+			pending_voxels, pending_frames = pending_voxels[still_pending], pending_frames[still_pending]
+
+		# The voxels that no other frame carves are foreground again, and active
+		restored = self.__binary_centroids_fore_back.set(pending_voxels)
+		self.__alive_levels = None
+		if not self.__tiled: self.__active_voxels = np.union1d(self.__active_voxels, pending_voxels).astype(self.__active_voxels.dtype)
+		self.__binary_centroids_fore_back.update_storage()
+
+		return restored
+
+
+
+
+	def __carve_views_chunk(self, voxels_idx: np.ndarray[int, np.int64], views: List[Tuple[np.ndarray[int, np.float64], np.ndarray[int, np.float64], np.ndarray[int, np.uint8]]],
+							affine_terms: np.ndarray[int, np.float64],
+							silhouette_tables: List[Tuple[np.ndarray[int, np.int32], np.ndarray[int, np.float32], np.ndarray[int, np.float32]]] | None,
+							corners_offsets: np.ndarray[int, np.float64] | None) -> Tuple[np.ndarray[int, np.int64], np.ndarray[int, np.int64]]:
+		'''
+		PURPOSE: test a chunk of voxels with a batch of frames in order, projecting in each frame only the voxels not carved by the previous ones
+		ARGUMENTS: 
+			- voxels_idx (np.ndarray[int, np.int64]): flat index of the voxels of the chunk
+			- views (List[Tuple[np.ndarray[int, np.float64], np.ndarray[int, np.float64], np.ndarray[int, np.uint8]]]): rotation vector,
+				translation vector and undistorted segmented frame of each frame
+			- affine_terms (np.ndarray[int, np.float64]): (K, 4, 3) affine terms [base; a; b; c] of the grid in each frame
+			- silhouette_tables (List[Tuple[np.ndarray[int, np.int32], np.ndarray[int, np.float32], np.ndarray[int, np.float32]]] | None): integral image
+				of the foreground and distances from the silhouette boundary of each frame, used by the footprint carving
+			- corners_offsets (np.ndarray[int, np.float64] | None): (K, 8, 3) voxel corners offsets in each frame, used by the footprint carving
+		RETURN: Tuple[np.ndarray[int, np.int64], np.ndarray[int, np.int64]]
+			- (np.ndarray[int, np.int64]): flat index of the voxels to carve
+			- (np.ndarray[int, np.int64]): position in the batch of the first frame that carves each of them
+		'''	
+
+		z_voxels, y_voxels, x_voxels = self.__grid_shape
+
+		# Homogeneous grid index [1, i, j, k] of each voxel, multiplied by the affine terms of each frame
+		grid_index = np.stack((np.ones_like(voxels_idx), voxels_idx % x_voxels, (voxels_idx // x_voxels) % y_voxels,
+							   voxels_idx // (x_voxels * y_voxels)), axis=1).astype(np.float64)
+
+		# The chunk stays in cache across the frames, and the voxels carved by a frame are dropped before projecting the next one,
+		# len(views) is the carving view of the voxels not carved
+		carving_view = np.full(voxels_idx.shape[0], len(views))
+		remaining = np.arange(voxels_idx.shape[0])
+		for frame_idx, (_, _, undist_b_f_image) in enumerate(views):
+			if remaining.shape[0] == 0: break
+
+			undistorted_resolution = (undist_b_f_image.shape[1], undist_b_f_image.shape[0])
+			camera_coords = grid_index[remaining] @ affine_terms[frame_idx]
+			imgpts = project_camera_points(camera_coords, self.__camera_matrix, self.__dist)
+
+			if self.__footprint:
+				# Only the voxels near the silhouette boundary need the footprint test
+				settled_foreground, carved = self.__get_settled_voxels(camera_coords, imgpts, undistorted_resolution, silhouette_tables[frame_idx][1:])
+				unsettled = np.flatnonzero(~(carved | settled_foreground))
+				imgpts_corners = project_camera_points(camera_coords[unsettled, np.newaxis, :] + corners_offsets[frame_idx], self.__camera_matrix, self.__dist)
+				_, all_background, _ = self.__get_footprints(imgpts_corners, undistorted_resolution, silhouette_tables[frame_idx][0])
+				carved[unsettled[all_background]] = True
+			else:
+				inside_idx, _, background = self.__get_background_centroids(imgpts, undistorted_resolution, undist_b_f_image)
+				carved = np.zeros(remaining.shape[0], dtype=bool)
+				carved[inside_idx[background]] = True
+
+			carving_view[remaining[carved]] = frame_idx
+			remaining = remaining[~carved]
+
+		carved = carving_view < len(views)
+
+		return voxels_idx[carved], carving_view[carved]
+
+
+
+
+	def __get_background_centroids(self, centr_coords: np.ndarray[int, np.float32], undistorted_resolution: Tuple[int, int], undist_b_f_image: np.ndarray[int, np.uint8]) \
+			-> Tuple[np.ndarray[int, np.int64], np.ndarray[int, np.int32], np.ndarray[int, np.bool_]]:
+		'''
+		PURPOSE: check which projected voxels centroid fall inside the image and on the background of the segmented image
+		ARGUMENTS: 
+			- centr_coords (np.ndarray[int, np.float32]): projected voxels centroid
+			- undistorted_resolution (Tuple[int, int]): undistorted image resolution
+			- undist_b_f_image (np.ndarray[int, np.uint8]): undistorted segmented frame
+		RETURN: Tuple[np.ndarray[int, np.int64], np.ndarray[int, np.int32], np.ndarray[int, np.bool_]]
+			- inside_idx (np.ndarray[int, np.int64]): index of the centroids that fall inside the image
+			- pixels (np.ndarray[int, np.int32]): pixel coordinates of the centroids that fall inside the image
+			- background (np.ndarray[int, np.bool_]): True for the inside centroids that fall on the background
+		'''	
+
+		# Keep only the projections that fall inside the image
+		inside_image = (centr_coords[:, 0] < undistorted_resolution[0]) & (centr_coords[:, 1] < undistorted_resolution[1]) & \
+			(centr_coords[:, 0] >= 0) & (centr_coords[:, 1] >= 0)
+		inside_idx = np.flatnonzero(inside_image)
+
+		# Get the pixel coordinates of all the projections at once and gather their mask value by flat index
+		pixels = centr_coords[inside_idx].astype(np.int32)
+		mask_values = np.take(undist_b_f_image, pixels[:, 1] * undist_b_f_image.shape[1] + pixels[:, 0])
+
+		return inside_idx, pixels, mask_values == 0
+
+
+
+
+	def __get_settled_voxels(self, camera_coords: np.ndarray[int, np.float64], imgpts_centroid: np.ndarray[int, np.float64], undistorted_resolution: Tuple[int, int],
+							 silhouette_distances: Tuple[np.ndarray[int, np.float32], np.ndarray[int, np.float32] | None]) -> Tuple[np.ndarray[int, np.bool_], np.ndarray[int, np.bool_]]:
+		'''
+		PURPOSE: find the voxels whose footprint is certainly entirely foreground or background, comparing a bound of their projected radius
+			with the distance of their centroid pixel from the silhouette boundary, so that they give the same result of the footprint test
+		ARGUMENTS: 
+			- camera_coords (np.ndarray[int, np.float64]): (M, 3) voxels centroid in the camera reference frame
+			- imgpts_centroid (np.ndarray[int, np.float64]): (M, 2) projected voxels centroid
+			- undistorted_resolution (Tuple[int, int]): undistorted image resolution
+			- silhouette_distances (Tuple[np.ndarray[int, np.float32], np.ndarray[int, np.float32] | None]): distances of the foreground and
+				background pixels from the silhouette boundary, without the background ones no voxel is settled outside
+		RETURN: Tuple[np.ndarray[int, np.bool_], np.ndarray[int, np.bool_]]
+			- settled_foreground (np.ndarray[int, np.bool_]): True when the footprint is entirely foreground, the voxel is kept
+			- settled_background (np.ndarray[int, np.bool_]): True when the footprint is entirely background and inside the image, the voxel is carved
+		'''	
+
+		width, height = undistorted_resolution
+		foreground_distance, background_distance = silhouette_distances
+		stretch, box, max_displacement = self.__projection_stretch_bound
+
+		# Bound of the displacement of the normalized coordinates between the centroid and the corners, valid in front of the camera
+		half_diagonal = self.__voxel_cube_edge_dim * np.sqrt(3) / 2
+		depth = camera_coords[:, 2]
+		in_front = depth > half_diagonal
+		safe_depth = np.where(in_front, depth, 2 * half_diagonal)
+		displacement = half_diagonal * np.linalg.norm(camera_coords, axis=1) / (safe_depth * (safe_depth - half_diagonal))
+		normalized = camera_coords[:, :2] / safe_depth[:, np.newaxis]
+		bounded = in_front & (displacement <= max_displacement) & np.all((normalized >= box[0]) & (normalized <= box[1]), axis=1)
+
+		# The footprint rectangle is enlarged by one pixel and floored, so it lies in a square of this half side around the centroid pixel
+		half_side = stretch * displacement + 3
+		inside = bounded & (imgpts_centroid[:, 0] >= 0) & (imgpts_centroid[:, 1] >= 0) & (imgpts_centroid[:, 0] < width) & (imgpts_centroid[:, 1] < height)
+		pixels = np.where(inside[:, np.newaxis], imgpts_centroid, 0).astype(np.int32)
+
+		# The square is settled when the circle that contains it does not reach the silhouette boundary
+		reach = np.sqrt(2) * half_side
+		settled_foreground = inside & (foreground_distance[pixels[:, 1], pixels[:, 0]] > reach)
+		if background_distance is None: return settled_foreground, np.zeros_like(settled_foreground)
+		settled_background = inside & (background_distance[pixels[:, 1], pixels[:, 0]] > reach) & (pixels[:, 0] - half_side >= 0) & \
+			(pixels[:, 1] - half_side >= 0) & (pixels[:, 0] + half_side < width) & (pixels[:, 1] + half_side < height)
+
+		return settled_foreground, settled_background
+
+
+
+
+	def __get_footprints(self, imgpts_corners: np.ndarray[int, np.float32], undistorted_resolution: Tuple[int, int], integral_image: np.ndarray[int, np.int32]) \
+			-> Tuple[np.ndarray[int, np.int32], np.ndarray[int, np.bool_], np.ndarray[int, np.bool_]]:
+		'''
+		PURPOSE: get the bounding rectangle of the projected corners of a set of boxes and check in O(1) if it is entirely background or foreground
+		ARGUMENTS: 
+			- imgpts_corners (np.ndarray[int, np.float32]): (M, 8, 2) projected corners of each box
+			- undistorted_resolution (Tuple[int, int]): undistorted image resolution
+			- integral_image (np.ndarray[int, np.int32]): integral image of the foreground of the segmented frame
+		RETURN: Tuple[np.ndarray[int, np.int32], np.ndarray[int, np.bool_], np.ndarray[int, np.bool_]]
+			- rects (np.ndarray[int, np.int32]): (M, 4) first column, first row, last column and last row of each rectangle
+			- all_background (np.ndarray[int, np.bool_]): True when the rectangle lies inside the image and contains no foreground
+			- all_foreground (np.ndarray[int, np.bool_]): True when the part of the rectangle inside the image contains no background
+		'''	
+
+		width, height = undistorted_resolution
+
+		# Bounding rectangle of the corners, enlarged by one pixel to absorb the lens distortion
+		x_min = np.floor(imgpts_corners[:, :, 0].min(axis=1)).astype(np.int32) - 1
+		y_min = np.floor(imgpts_corners[:, :, 1].min(axis=1)).astype(np.int32) - 1
+		x_max = np.floor(imgpts_corners[:, :, 0].max(axis=1)).astype(np.int32) + 1
+		y_max = np.floor(imgpts_corners[:, :, 1].max(axis=1)).astype(np.int32) + 1
+
+		# Count the foreground pixels of the part of the rectangle inside the image, what falls outside the image is never carved
+		x_min_in, y_min_in = np.clip(x_min, 0, width - 1), np.clip(y_min, 0, height - 1)
+		x_max_in, y_max_in = np.clip(x_max, 0, width - 1), np.clip(y_max, 0, height - 1)
+		outside = (x_min >= width) | (y_min >= height) | (x_max < 0) | (y_max < 0)
+		area = np.where(outside, 0, (x_max_in - x_min_in + 1) * (y_max_in - y_min_in + 1))
+		foreground = np.where(outside, 0, count_foreground_in_rects(integral_image, x_min_in, y_min_in, x_max_in, y_max_in))
+
+		all_background = (foreground == 0) & (x_min >= 0) & (y_min >= 0) & (x_max < width) & (y_max < height)
+		all_foreground = foreground == area
+
+		return np.stack((x_min, y_min, x_max, y_max), axis=1), all_background, all_foreground
+
+
+
+
+	def __get_alive_levels(self) -> List[np.ndarray[int, np.bool_] | None]:
+		'''
+		PURPOSE: get the pyramid of the cells that still contain a foreground voxel, built from the occupancy grid the first time
+			and then updated incrementally by the hierarchical carving
+		ARGUMENTS: None
+		RETURN:
+			- (List[np.ndarray[int, np.bool_] | None]): cells of each level, the cells at level l are made of 2^l voxels per edge,
+				None at level 0 since the single voxels are read from the occupancy grid
+		'''	
+
+		if self.__alive_levels is None:
+			alive = self.__binary_centroids_fore_back.to_dense()
+			self.__alive_levels = [None]
+			while max(alive.shape) > 4:
+				padded = np.pad(alive, [(0, size % 2) for size in alive.shape])
+				halves = [size // 2 for size in padded.shape]
+				alive = padded.reshape(halves[0], 2, halves[1], 2, halves[2], 2).any(axis=(1, 3, 5))
+				self.__alive_levels.append(alive)
+
+		return self.__alive_levels
+
+
+
+
+	def __test_cells(self, level: int, cells: np.ndarray[int, np.int64]) -> np.ndarray[int, np.bool_]:
+		'''
+		PURPOSE: check which cells of a level of the pyramid still contain a foreground voxel
+		ARGUMENTS: 
+			- level (int): level of the cells
+			- cells (np.ndarray[int, np.int64]): (M, 3) [z, y, x] index of the cells, inside the level
+		RETURN:
+			- (np.ndarray[int, np.bool_]): True for the cells that contain a foreground voxel
+		'''	
+
+		if level == 0: return self.__binary_centroids_fore_back.test(np.ravel_multi_index(tuple(cells.T), self.__grid_shape))
+
+		return self.__alive_levels[level][tuple(cells.T)]
+
+
+
+
+	def __get_children_cells(self, level: int, cells: np.ndarray[int, np.int64]) -> Tuple[np.ndarray[int, np.int64], np.ndarray[int, np.bool_]]:
+		'''
+		PURPOSE: get the 8 children of a set of cells that fall inside the level below
+		ARGUMENTS: 
+			- level (int): level of the cells, greater than 0
+			- cells (np.ndarray[int, np.int64]): (M, 3) [z, y, x] index of the cells
+		RETURN: Tuple[np.ndarray[int, np.int64], np.ndarray[int, np.bool_]]
+			- (np.ndarray[int, np.int64]): (M * 8, 3) index of the children, the ones outside the level below included
+			- (np.ndarray[int, np.bool_]): True for the children inside the level below
+		'''	
+
+		children_shape = self.__grid_shape if level == 1 else self.__alive_levels[level - 1].shape
+		children = np.reshape(cells[:, np.newaxis, :] * 2 + self.__box_corners_selector[:, ::-1], (-1, 3))
+
+		return children, np.all(children < children_shape, axis=1)
+
+
+
+
+	def __clear_cells(self, level: int, cells: np.ndarray[int, np.int64], frame_index: int) -> None:
+		'''
+		PURPOSE: set as background the voxels of a set of cells decided as background, clearing only the runs of flat indices
+			along x of each cell instead of a mask of the whole grid
+		ARGUMENTS: 
+			- level (int): level of the cells
+			- cells (np.ndarray[int, np.int64]): (M, 3) [z, y, x] index of the cells
+			- frame_index (int): index of the frame recorded by the carve provenance
+		RETURN: None
+		'''	
+
+		if level > 0: self.__alive_levels[level][tuple(cells.T)] = False
+
+		z_voxels, y_voxels, x_voxels = self.__grid_shape
+		edge = 2 ** level
+		# Offsets along z and y of the rows of voxels of a cell
+		rows_offsets = np.reshape(np.stack(np.meshgrid(np.arange(edge), np.arange(edge), indexing='ij'), axis=-1), (-1, 2))
+
+		cells_step = max(1, clear_chunk_voxels // edge ** 3)
+		for first in range(0, cells.shape[0], cells_step):
+			first_voxel = cells[first:first + cells_step] * edge
+			rows = first_voxel[:, np.newaxis, :2] + rows_offsets
+			in_grid = (rows[:, :, 0] < z_voxels) & (rows[:, :, 1] < y_voxels)
+			starts = ((rows[:, :, 0] * y_voxels + rows[:, :, 1]) * x_voxels + first_voxel[:, np.newaxis, 2])[in_grid]
+			lengths = np.broadcast_to(np.minimum(edge, x_voxels - first_voxel[:, 2])[:, np.newaxis], in_grid.shape)[in_grid]
+
+			# Expand the runs into their flat indices, keeping only the voxels still set
+			voxels_idx = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(np.sum(lengths))
+			voxels_idx = voxels_idx[self.__binary_centroids_fore_back.test(voxels_idx)]
+			self.__record_carved_voxels(voxels_idx, frame_index)
+			self.__binary_centroids_fore_back.clear(voxels_idx)
+
+
+
+
+	def __update_alive_ancestors(self, carved_cells: List[np.ndarray[int, np.int64]]) -> None:
+		'''
+		PURPOSE: clear in the pyramid the ancestors of the carved cells that no longer contain a foreground voxel, checking only the children
+			of the cells whose descendants changed
+		ARGUMENTS: 
+			- carved_cells (List[np.ndarray[int, np.int64]]): (M, 3) index of the cells carved at each level
+		RETURN: None
+		'''	
+
+		changed = carved_cells[0]
+		for level in range(1, len(self.__alive_levels)):
+			level_shape = self.__alive_levels[level].shape
+			parents = np.stack(np.unravel_index(np.unique(np.ravel_multi_index(tuple((changed // 2).T), level_shape)), level_shape), axis=1)
+			children, in_level = self.__get_children_cells(level, parents)
+			children_alive = np.zeros(children.shape[0], dtype=bool)
+			children_alive[in_level] = self.__test_cells(level - 1, children[in_level])
+			emptied = parents[~np.any(np.reshape(children_alive, (-1, 8)), axis=1)]
+			self.__alive_levels[level][tuple(emptied.T)] = False
+			changed = np.concatenate((emptied, carved_cells[level]))
+
+
+
+
+	def __set_background_cells(self, undistorted_resolution: Tuple[int, int], undist_b_f_image: np.ndarray[int, np.uint8], frame_index: int) -> np.ndarray[int, np.bool_]:
+		'''
+		PURPOSE: coarse to fine carving, a cell of voxels is decided at once when its footprint is entirely background or foreground,
+			otherwise it is subdivided until reaching the single voxels, that are checked by their centroid or by their footprint
+		ARGUMENTS: 
+			- undistorted_resolution (Tuple[int, int]): undistorted image resolution
+			- undist_b_f_image (np.ndarray[int, np.uint8]): undistorted segmented frame
+			- frame_index (int): index of the frame recorded by the carve provenance
+		RETURN:
+			- carved_pixels (np.ndarray[int, np.bool_]): pixels covered by the voxels carved in this frame
+		'''	
+
+		integral_image = get_foreground_integral_image(undist_b_f_image)
+
+		# Only the cells that still contain a foreground voxel are visited, starting from the top of the pyramid
+		alive = self.__get_alive_levels()
+		top_level = len(alive) - 1
+		cells = np.argwhere(alive[top_level]) if top_level > 0 else \
+			np.stack(np.unravel_index(self.__binary_centroids_fore_back.get_set_in_range(0, self.__voxels_count), self.__grid_shape), axis=1)
+		carved_cells = [np.zeros((0, 3), dtype=np.int64) for _ in alive]
+		carved_rects = []
+
+		# With the footprint carving also the single voxels are decided by their footprint
+		for level in range(top_level, -1 if self.__footprint else 0, -1):
+
+			if cells.shape[0] == 0: break
+
+			# Box spanned by the centroids of each cell, or by the whole voxels with the footprint carving
+			# The cells store [z, y, x] indices while the box is in (x, y, z) coordinates
+			first_voxel = cells * 2 ** level
+			last_voxel = np.minimum(first_voxel + 2 ** level, self.__grid_shape) - 1
+			lower, upper = first_voxel[:, ::-1].astype(np.float64), last_voxel[:, ::-1].astype(np.float64)
+			if self.__footprint:
+				lower, upper = lower - 0.5, upper + 0.5
+
+			# Project the 8 box corners and check their bounding rectangle
+			corners = np.where(self.__box_corners_selector, upper[:, np.newaxis, :], lower[:, np.newaxis, :])
+			imgpts_corners = project_camera_points(self.__grid_base + corners @ self.__grid_axes, self.__camera_matrix, self.__dist)
+			rects, all_background, all_foreground = self.__get_footprints(imgpts_corners, undistorted_resolution, integral_image)
+
+			# Carve the cells entirely on the background
+			carved_cells[level] = cells[all_background]
+			carved_rects.append(rects[all_background])
+
+			if level == 0: break
+
+			# Subdivide the ambiguous cells keeping only the children that still contain a foreground voxel
+			children, in_level = self.__get_children_cells(level, cells[~all_background & ~all_foreground])
+			children = children[in_level]
+			cells = children[self.__test_cells(level - 1, children)]
+
+		# Pixels covered by the carved cells footprints
+		carved_rects = np.concatenate(carved_rects) if len(carved_rects) > 0 else np.zeros((0, 4), dtype=np.int32)
+		carved_pixels = fill_rects_mask(undist_b_f_image.shape[:2], *carved_rects.T)
+
+		# Otherwise check the remaining single voxels by their centroid
+		if not self.__footprint and cells.shape[0] > 0:
+			imgpts_voxels_centroid = project_camera_points(self.__get_voxels_camera_coords(np.ravel_multi_index(tuple(cells.T), self.__grid_shape)),
+														  self.__camera_matrix, self.__dist)
+			inside_idx, pixels, background = self.__get_background_centroids(imgpts_voxels_centroid, undistorted_resolution, undist_b_f_image)
+			carved_cells[0] = cells[inside_idx[background]]
+			carved_pixels[pixels[background, 1], pixels[background, 0]] = True
+
+		# Clear the voxels of the carved cells and the ancestors left without foreground voxels
+		for level, cells in enumerate(carved_cells):
+			if cells.shape[0] > 0: self.__clear_cells(level, cells, frame_index)
+		self.__update_alive_ancestors(carved_cells)
+
+		return carved_pixels
+
+
+
+
+	def get_foreground_bounding_box(self) -> Tuple[np.ndarray[int, np.float64], np.ndarray[int, np.float64]] | None:
+		'''
+		PURPOSE: get the axis aligned box that contains all the foreground voxels
+		ARGUMENTS: None
+		RETURN:
+			- (Tuple[np.ndarray[int, np.float64], np.ndarray[int, np.float64]] | None): lower and upper x, y, z coordinates of the box,
+				None if every voxel is carved
+		'''	
+
+		if self.__intervals:
+			columns, z_starts, z_ends = self.__binary_centroids_fore_back.get_intervals()
+			if columns.shape[0] == 0: return None
+			slice_height = self.__voxel_cube_edge_dim / self.__z_subdivisions
+			lower_xy = np.stack((columns % self.__grid_shape[2], columns // self.__grid_shape[2]), axis=-1) * self.__voxel_cube_edge_dim
+			return self.__grid_lower + np.append(lower_xy.min(axis=0), z_starts.min() * slice_height), \
+				self.__grid_lower + np.append(lower_xy.max(axis=0) + self.__voxel_cube_edge_dim, z_ends.max() * slice_height)
+
+		mantained_centroids_idx = np.concatenate([np.zeros(0, dtype=np.int64)] + list(self.__map_active_chunks(
+			lambda voxels_idx: voxels_idx[self.__binary_centroids_fore_back.test(voxels_idx)], chunk_voxels, 1)))
+		if mantained_centroids_idx.shape[0] == 0: return None
+
+		# The grid index is [z, y, x] while the box is in (x, y, z) coordinates
+		grid_index = np.column_stack(np.unravel_index(mantained_centroids_idx, self.__grid_shape))[:, ::-1]
+
+		return self.__grid_lower + grid_index.min(axis=0) * self.__voxel_cube_edge_dim, \
+			self.__grid_lower + (grid_index.max(axis=0) + 1) * self.__voxel_cube_edge_dim
+
+
+
+
+	def get_cubes_coords_and_faces(self) -> Tuple[np.ndarray[int, np.float32], np.ndarray[int, np.int32]]:
 		'''
 		PURPOSE: get the voxels cube coordinates and faces to write a PLY file
 		ARGUMENTS: None
-		RETURN: Tuple[np.ndarray[int, np.float32], np.ndarray[int, np.float32]]
+		RETURN: Tuple[np.ndarray[int, np.float32], np.ndarray[int, np.int32]]
 			- voxels_cube_coords (np.ndarray[int, np.float32]): voxel centroid coordinates belonging to the foreground
-			- voxels_cube_faces (np.ndarray[int, np.float32]): voxel cube faces belonging to the foreground
+			- voxels_cube_faces (np.ndarray[int, np.int32]): voxel cube faces belonging to the foreground
 		'''	
 
-		new_shape_bits_centroids = np.asarray(self.__voxels_center.shape[:3])
-		new_shape_bits_centroids = np.append(new_shape_bits_centroids, np.array([1]))
-  
-		binary_centroids_fore_back_reshaped = np.reshape(self.__binary_centroids_fore_back, new_shape_bits_centroids)
-		# Get the ID of the centroid that belong to the foreground
-		mantained_centroids_idx = np.argwhere(binary_centroids_fore_back_reshaped == 1)
+		# Each interval of the column intervals is exported as a single box
+		if self.__intervals:
+			columns, z_starts, z_ends = self.__binary_centroids_fore_back.get_intervals()
+			slice_height = self.__voxel_cube_edge_dim / self.__z_subdivisions
+			lower_xy = self.__grid_lower[:2] + np.stack((columns % self.__grid_shape[2], columns // self.__grid_shape[2]), axis=-1) * self.__voxel_cube_edge_dim
+			return get_boxes_coords_and_faces(np.column_stack((lower_xy, self.__grid_lower[2] + z_starts * slice_height)),
+											  np.column_stack((lower_xy + self.__voxel_cube_edge_dim, self.__grid_lower[2] + z_ends * slice_height)), slice_height)
 
-		# Get their cube coordinates
-		resulting_voxels = self.__voxs_cubes_verts_coords[mantained_centroids_idx[:, 0], mantained_centroids_idx[:, 1], mantained_centroids_idx[:, 2]]
+		# Get the flat index of the centroids that belong to the foreground, chunk by chunk of the active voxels
+		mantained_centroids_idx = np.concatenate([np.zeros(0, dtype=np.int64)] + list(self.__map_active_chunks(
+			lambda voxels_idx: voxels_idx[self.__binary_centroids_fore_back.test(voxels_idx)], chunk_voxels, 1)))
 
-		# Reshaping the coordinates
-		voxels_cube_coords = np.reshape(resulting_voxels, (resulting_voxels.shape[0] * 8, 3))
-  
-		# Initialize the np.array to store the faces of each voxel cube
-		voxels_cube_faces = np.zeros((0,5), dtype=np.int32)
-
-		# Full the faces vector with the correct voxel cube vertices ID
-		for idx in range(0, voxels_cube_coords.shape[0], 8):
-			voxels_cube_faces = np.vstack((voxels_cube_faces, np.array([4, idx + 2, idx + 0, idx + 1, idx + 3])))
-			voxels_cube_faces = np.vstack((voxels_cube_faces, np.array([4, idx + 6, idx + 4, idx + 5, idx + 7])))
-			voxels_cube_faces = np.vstack((voxels_cube_faces, np.array([4, idx + 6, idx + 4, idx + 0, idx + 2])))
-			voxels_cube_faces = np.vstack((voxels_cube_faces, np.array([4, idx + 7, idx + 5, idx + 1, idx + 3])))
-			voxels_cube_faces = np.vstack((voxels_cube_faces, np.array([4, idx + 0, idx + 4, idx + 5, idx + 1])))
-			voxels_cube_faces = np.vstack((voxels_cube_faces, np.array([4, idx + 2, idx + 6, idx + 7, idx + 3])))
-   
-		return voxels_cube_coords, voxels_cube_faces
+		# Compute only their cube coordinates
+		resulting_voxels = self.get_voxels_cubes_verts_coords(mantained_centroids_idx)
+
+		# The first and the last vertex of each cube are its upper and lower corners, the neighbouring cubes share the corners on the voxels lattice
+		return get_boxes_coords_and_faces(resulting_voxels[:, 7], resulting_voxels[:, 0], self.__voxel_cube_edge_dim)
 
 
 